@@ -0,0 +1,229 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from io import StringIO
+
+import django
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .instrumentation import peak_rss_mb
+from .models import Book, Favorite, User
+from .synthetic import CatalogGenerator, write_jsonl
+
+API_ROOT = '/api/library'
+
+SCENARIOS = ['import', 'similarities', 'search', 'pagination', 'favorites', 'recommendations']
+
+# Favorites per benchmark user; stays under the 20-favorite cap so favorites can be added
+FAVORITES_PER_USER = 10
+
+
+def summarize(latencies, queries):
+    """Latency percentiles in milliseconds plus queries per request."""
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p90_ms': round(float(np.percentile(latencies, 90)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'queries_mean': round(float(np.mean(queries)), 2),
+        'queries_max': int(max(queries)),
+    }
+
+
+def run_metadata(options):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': options,
+    }
+
+
+class BenchmarkRun:
+    """
+    Runs the selected scenarios against the current (throwaway) database.
+    Every input is drawn from generators seeded with ``seed``, so two runs with
+    the same options issue the same requests against the same catalog.
+    """
+
+    def __init__(self, seed=0, books=5000, sizes=(), requests=200, users=50, batch_size=1000, log=print):
+        self.seed = seed
+        self.books = books
+        self.sizes = sorted(sizes)
+        self.requests = requests
+        self.users = users
+        self.batch_size = batch_size
+        self.log = log
+        self.generator = CatalogGenerator(seed)
+        self.workdir = tempfile.TemporaryDirectory()
+        self.client = APIClient()
+        self.user_ids = []
+
+    def close(self):
+        self.workdir.cleanup()
+
+    def import_records(self, count):
+        """Append ``count`` synthetic books after those already loaded; returns elapsed seconds."""
+        start = Book.objects.count()
+        path = write_jsonl(os.path.join(self.workdir.name, f'books-{start}.jsonl'), count, self.seed, start=start)
+        started = time.perf_counter()
+        call_command('import_books', path, limit=count, batch_size=self.batch_size, stdout=StringIO())
+        return time.perf_counter() - started
+
+    def resize(self, size):
+        """Grow the catalog with the next synthetic records, or drop the newest books, until it holds ``size``."""
+        count = Book.objects.count()
+        if count < size:
+            self.import_records(size - count)
+        elif count > size:
+            newest = Book.objects.order_by('id').values_list('id', flat=True)[size:]
+            Book.objects.filter(id__in=list(newest)).delete()
+
+    def run(self, scenarios):
+        results = {}
+        for scenario in SCENARIOS:
+            if scenario not in scenarios:
+                continue
+            if scenario not in ('import', 'similarities'):
+                self.resize(self.books)
+            self.log(f'Running {scenario}...')
+            results[scenario] = getattr(self, f'bench_{scenario}')()
+            results[scenario]['peak_rss_mb'] = peak_rss_mb()
+            self.log(f'  {json.dumps(results[scenario])}')
+        return results
+
+    def bench_import(self):
+        count = self.books - Book.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            elapsed = self.import_records(count)
+        return {
+            'rows': count,
+            'seconds': round(elapsed, 3),
+            'rows_per_sec': round(count / elapsed, 1),
+            'queries': len(queries),
+        }
+
+    def bench_similarities(self):
+        runs = []
+        for size in self.sizes or [self.books]:
+            self.resize(size)
+            started = time.perf_counter()
+            call_command('compute_similarities', stdout=StringIO())
+            elapsed = time.perf_counter() - started
+            runs.append({
+                'books': size,
+                'seconds': round(elapsed, 3),
+                'rows_per_sec': round(size / elapsed, 1),
+                'peak_rss_mb': peak_rss_mb(),
+            })
+        return {'runs': runs}
+
+    def timed(self, method, url, data=None):
+        """``(seconds, queries)`` of one request with the catalog and recommendation caches cold."""
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(self.client, method)(url, data, format='json')
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method.upper()} {url} returned {response.status_code}')
+        return elapsed, len(captured)
+
+    def measure(self, requests):
+        """Summary of ``timed`` over ``(method, url, data)`` requests."""
+        latencies, queries = zip(*(self.timed(*request) for request in requests))
+        return summarize(latencies, queries)
+
+    def bench_search(self):
+        terms = self.generator.search_terms(self.requests)
+        return self.measure(('get', f'{API_ROOT}/books/', {'search': term}) for term in terms)
+
+    def bench_pagination(self):
+        last_page = max(1, -(-Book.objects.count() // 100))
+        rng = random.Random(f'{self.seed}:pages')
+        # Page numbers from the deepest half of the catalog
+        pages = [rng.randint((last_page + 1) // 2, last_page) for _ in range(self.requests)]
+        page_number = self.measure(('get', f'{API_ROOT}/books/', {'page': page, 'page_size': 100}) for page in pages)
+
+        # Keyset pages, walked from the start as a crawler would
+        self.client.get(f'{API_ROOT}/books/', {'pagination': 'cursor', 'page_size': 100})
+        links = []
+        url = f'{API_ROOT}/books/?pagination=cursor&page_size=100'
+        while url and len(links) < self.requests:
+            links.append(url)
+            url = self.client.get(url).json()['next']
+        cursor = self.measure(('get', link, None) for link in links)
+        return {'page_number': page_number, 'cursor': cursor}
+
+    def ensure_users(self):
+        """Create the benchmark users with seeded favorites, and the neighbour table their recommendations need."""
+        if self.user_ids:
+            return
+        call_command('compute_similarities', stdout=StringIO())
+        book_ids = list(Book.objects.order_by('id').values_list('id', flat=True))
+        rng = random.Random(f'{self.seed}:users')
+        users = User.objects.bulk_create([User(username=f'bench{i}') for i in range(self.users)])
+        Favorite.objects.bulk_create([
+            Favorite(user=user, book_id=book_id)
+            for user in users
+            for book_id in rng.sample(book_ids, min(FAVORITES_PER_USER, len(book_ids)))
+        ])
+        self.user_ids = [user.id for user in users]
+        self.book_ids = book_ids
+
+    def as_user(self, user_id):
+        self.client.force_authenticate(user=User(id=user_id))
+
+    def bench_favorites(self):
+        """Favorite adds, each followed by the (eager) recommendation refresh it schedules."""
+        self.ensure_users()
+        rng = random.Random(f'{self.seed}:favorites')
+        timings = []
+        for i in range(self.requests):
+            user_id = self.user_ids[i % len(self.user_ids)]
+            favorites = set(Favorite.objects.filter(user_id=user_id).values_list('book_id', flat=True))
+            book_id = rng.choice([book_id for book_id in self.book_ids if book_id not in favorites])
+            self.as_user(user_id)
+            timings.append(self.timed('post', f'{API_ROOT}/favorites/', {'book_id': book_id}))
+            # Undo the add so every request starts from the same favorites
+            Favorite.objects.filter(user_id=user_id, book_id=book_id).delete()
+        self.client.force_authenticate(user=None)
+        return summarize(*zip(*timings))
+
+    def bench_recommendations(self):
+        self.ensure_users()
+        users = [self.user_ids[i % len(self.user_ids)] for i in range(self.requests)]
+        cold = []
+        cached = []
+        for user_id in users:
+            self.as_user(user_id)
+            cold.append(self.timed('get', f'{API_ROOT}/recommendations/'))
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                self.client.get(f'{API_ROOT}/recommendations/')
+                elapsed = time.perf_counter() - started
+            cached.append((elapsed, len(captured)))
+        self.client.force_authenticate(user=None)
+        return {'cold': summarize(*zip(*cold)), 'cached': summarize(*zip(*cached))}
@@ -0,0 +1,153 @@
+import io
+from itertools import islice
+
+from django.db import connections, router
+
+# Rows written per COPY statement or bulk_create call
+COPY_BATCH_SIZE = 100000
+# Primary keys per DELETE statement when a table cannot be truncated
+DELETE_BATCH_SIZE = 50000
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (bytes, memoryview)):
+        # bytea hex format, with the backslash escaped for COPY
+        return '\\\\x' + bytes(value).hex()
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def copy_rows(model, fields, rows, batch_size=COPY_BATCH_SIZE):
+    """
+    Insert ``rows`` (tuples ordered like ``fields``, using attnames such as
+    ``book1_id``) into ``model``'s table.
+
+    PostgreSQL with psycopg2 loads the rows with ``COPY ... FROM STDIN``;
+    other backends fall back to ``bulk_create``. Returns the number of rows
+    written.
+    """
+    connection = connections[router.db_for_write(model)]
+    rows = iter(rows)
+    columns = [model._meta.get_field(field).column for field in fields]
+    total = _copy(connection, model._meta.db_table, columns, rows, batch_size)
+    if total is not None:
+        return total
+
+    objects = [model(**dict(zip(fields, row))) for row in rows]
+    model.objects.using(connection.alias).bulk_create(objects, batch_size=10000)
+    return len(objects)
+
+
+def _copy(connection, table, columns, rows, batch_size):
+    """``COPY`` ``rows`` into ``table``; None, with no row consumed, where COPY is unavailable."""
+    if connection.vendor != 'postgresql':
+        return None
+    quote = connection.ops.quote_name
+    statement = f'COPY {quote(table)} ({", ".join(quote(column) for column in columns)}) FROM STDIN'
+    total = 0
+    with connection.cursor() as cursor:
+        copy_expert = getattr(cursor.cursor, 'copy_expert', None)
+        if copy_expert is None:
+            return None
+        while True:
+            buffer = io.StringIO()
+            count = 0
+            for row in rows:
+                buffer.write('\t'.join(_copy_value(value) for value in row))
+                buffer.write('\n')
+                count += 1
+                if count >= batch_size:
+                    break
+            if not count:
+                return total
+            buffer.seek(0)
+            copy_expert(statement, buffer)
+            total += count
+
+
+def stage_rows(model, fields, rows, batch_size=COPY_BATCH_SIZE):
+    """
+    Load ``rows`` (the primary key followed by ``fields``) into a temporary
+    table of ``model``'s columns, for ``update_from_staged`` to apply later
+    on the same connection with a single statement. Returns the table name.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table = f'staged_{model._meta.db_table}'
+    columns = [model._meta.pk.column] + [model._meta.get_field(field).column for field in fields]
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {quote(table)}')
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE {quote(table)} AS '
+            f'SELECT {", ".join(quote(column) for column in columns)} FROM {quote(model._meta.db_table)} WHERE 1 = 0'
+        )
+        if _copy(connection, table, columns, rows, batch_size) is None:
+            statement = (
+                f'INSERT INTO {quote(table)} ({", ".join(quote(column) for column in columns)}) '
+                f'VALUES ({", ".join(["%s"] * len(columns))})'
+            )
+            while batch := list(islice(rows, batch_size)):
+                cursor.executemany(statement, batch)
+    return table
+
+
+def update_from_staged(model, fields, table, where='', params=()):
+    """
+    Set ``fields`` of ``model``'s rows from the ``stage_rows`` table with one
+    ``UPDATE ... FROM``, then drop it. ``where`` is an extra SQL condition on
+    the columns of ``model``'s table. Returns the number of rows updated.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    target = quote(model._meta.db_table)
+    pk = quote(model._meta.pk.column)
+    columns = [quote(model._meta.get_field(field).column) for field in fields]
+    assignments = ', '.join(f'{column} = staged.{column}' for column in columns)
+    condition = f' AND ({where})' if where else ''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {target} SET {assignments} FROM {quote(table)} AS staged '
+            f'WHERE {target}.{pk} = staged.{pk}{condition}',
+            params,
+        )
+        updated = cursor.rowcount
+        cursor.execute(f'DROP TABLE {quote(table)}')
+    return updated
+
+
+def clear_tables(models, batch_size=DELETE_BATCH_SIZE):
+    """
+    Delete every row of ``models``, which must include every model whose
+    rows reference them, listed dependants first.
+
+    PostgreSQL empties them with a single ``TRUNCATE ... CASCADE``. Other
+    backends delete ranges of ``batch_size`` primary keys, one statement per
+    range, so outside an atomic block no transaction grows with the table.
+    Both bypass the ORM's delete collector and signals, so callers
+    invalidate caches themselves.
+    """
+    connection = connections[router.db_for_write(models[0])]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'TRUNCATE TABLE {", ".join(quote(model._meta.db_table) for model in models)} CASCADE')
+            return
+        for model in models:
+            table = quote(model._meta.db_table)
+            pk = quote(model._meta.pk.column)
+            while True:
+                cursor.execute(f'SELECT MIN({pk}) FROM {table}')
+                start = cursor.fetchone()[0]
+                if start is None:
+                    break
+                cursor.execute(f'DELETE FROM {table} WHERE {pk} < %s', [start + batch_size])
@@ -0,0 +1,140 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Bumped to drop every cached catalog response at once, e.g. after an import
+EPOCH_KEY = 'catalog:epoch'
+BOOKS_KEY = 'catalog:books'
+AUTHORS_KEY = 'catalog:authors'
+# Author names embedded in book responses
+AUTHOR_DATA_KEY = 'catalog:author-data'
+
+
+def book_key(book_id):
+    return f'catalog:book:{book_id}'
+
+
+def author_key(author_id):
+    return f'catalog:author:{author_id}'
+
+
+def versions(keys):
+    """
+    Current value of each version counter. Missing counters start at the
+    current time in nanoseconds, so a counter evicted from the cache never
+    comes back with a value it has already had.
+    """
+    values = cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        values.update(cache.get_many(missing))
+    return [values.get(key) for key in keys]
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def _bump_on_commit(keys):
+    _bump(keys)
+    # A read racing the transaction could cache the old rows under the new version; bump again once committed
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(keys))
+
+
+def invalidate_books(book_ids):
+    # New books can bring new authors with them
+    _bump_on_commit([BOOKS_KEY, AUTHORS_KEY, *map(book_key, book_ids)])
+
+
+def invalidate_authors(author_ids):
+    _bump_on_commit([AUTHORS_KEY, BOOKS_KEY, AUTHOR_DATA_KEY, *map(author_key, author_ids)])
+
+
+def invalidate_catalog():
+    _bump_on_commit([EPOCH_KEY])
+
+
+class CachedReadMixin:
+    """
+    Caches rendered JSON list and retrieve responses and answers conditional GETs.
+    Only with CATALOG_RESPONSE_CACHE, which needs a cache shared by all processes.
+
+    Entries are keyed on the version counters a response depends on, so
+    writes invalidate them by bumping a counter instead of deleting keys.
+    Responses carry a strong ETag (a hash of the body) and a Last-Modified
+    taken from the ``updated_at`` of the objects they contain. Only single
+    objects honour If-Modified-Since: a deletion leaves a page's newest
+    ``updated_at`` unchanged.
+    """
+    cache_list_versions = ()
+    # Formatted with the lookup value as ``pk``
+    cache_detail_versions = ()
+    cache_objects = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.cache_list_versions, False, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        version_keys = [key.format(pk=pk) for key in self.cache_detail_versions]
+        return self.cached_response(request, version_keys, True, super().retrieve, *args, **kwargs)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        self.cache_objects = page or ()
+        return page
+
+    def get_object(self):
+        obj = super().get_object()
+        self.cache_objects = [obj]
+        return obj
+
+    def object_last_modified(self, obj):
+        return obj.updated_at
+
+    def cached_response(self, request, version_keys, detail, handler, *args, **kwargs):
+        if not settings.CATALOG_RESPONSE_CACHE or request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+
+        key_source = repr((
+            versions([EPOCH_KEY, *version_keys]), request.build_absolute_uri(), request.accepted_media_type
+        ))
+        key = f'catalog:response:{hashlib.sha1(key_source.encode()).hexdigest()}'
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            modified = [self.object_last_modified(obj) for obj in self.cache_objects]
+            entry = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': f'"{hashlib.sha1(response.content).hexdigest()}"',
+                'last_modified': int(max(modified).timestamp()) if modified else None,
+            }
+            cache.set(key, entry, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        if entry['last_modified'] is not None:
+            response['Last-Modified'] = http_date(entry['last_modified'])
+        return get_conditional_response(
+            request, etag=entry['etag'], last_modified=entry['last_modified'] if detail else None, response=response
+        )
@@ -0,0 +1,660 @@
+import hashlib
+import json
+import os
+from collections import Counter, deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import ijson
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Author, Book, Shelf
+from .search import update_search_vectors
+
+# Records resolved and inserted per transaction
+DEFAULT_BATCH_SIZE = 1000
+
+# Chunk size for name__in lookups
+LOOKUP_CHUNK_SIZE = 1000
+
+# Book columns rewritten when an upsert finds a changed record
+UPSERT_FIELDS = [
+    'title', 'isbn', 'isbn13', 'language', 'average_rating', 'book_format', 'num_pages',
+    'publisher', 'publication_date', 'description', 'image_url', 'content_hash', 'similarity_dirty', 'updated_at',
+]
+
+
+def _to_float(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _to_int(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def split_author_name(full_name):
+    name_parts = full_name.strip().split(' ', 1)
+    if len(name_parts) == 2:
+        return name_parts[0], name_parts[1]
+    return name_parts[0], ''
+
+
+def parse_record(item):
+    """
+    Turn one Goodreads-style JSON record into ``(book_fields, shelf_names, author_names)``.
+
+    ``author_names`` holds ``(first_name, last_name)`` pairs. Duplicates are
+    removed while keeping the original order.
+    """
+    book_fields = {
+        'title': item.get('title', 'Unknown Title'),
+        'isbn': item.get('isbn', None),
+        'isbn13': item.get('isbn13', None),
+        'language': item.get('language', 'Unknown Language'),
+        'average_rating': _to_float(item.get('average_rating', None)),
+        'book_format': item.get('format', 'Unknown Format'),
+        'num_pages': _to_int(item.get('num_pages', None)),
+        'publisher': item.get('publisher', 'Unknown Publisher'),
+        'publication_date': item.get('publication_date', None),
+        'description': item.get('description', ''),
+        'image_url': item.get('image_url', ''),
+    }
+    shelf_names = []
+    for shelf_data in item.get('shelves', []):
+        shelf_name = shelf_data.get('name', '').lower()
+        if shelf_name and shelf_name not in shelf_names:
+            shelf_names.append(shelf_name)
+    author_names = []
+    for author_data in item.get('authors', []):
+        name = split_author_name(author_data.get('name', 'Unknown Author'))
+        if name not in author_names:
+            author_names.append(name)
+    return book_fields, shelf_names, author_names
+
+
+def record_key(record):
+    """Upsert key of a parsed record: ``('isbn13', value)``, ``('isbn', value)`` or None."""
+    book_fields = record[0]
+    if book_fields['isbn13']:
+        return 'isbn13', book_fields['isbn13']
+    if book_fields['isbn']:
+        return 'isbn', book_fields['isbn']
+    return None
+
+
+def content_hash(record):
+    """Stable hash of a parsed record's book fields, shelves and authors."""
+    payload = json.dumps(record, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _chunks(items, size=LOOKUP_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BookLoader:
+    """
+    Load parsed records in batches with set-based queries.
+
+    Shelf and author ids are kept in name -> id caches for the loader's
+    lifetime. Each batch resolves only the names it has not seen yet, then
+    bulk-creates the books and the M2M through rows.
+
+    With ``upsert`` records are matched to stored books on ``isbn13``,
+    falling back to ``isbn``. Matches whose content hash differs are
+    updated in bulk; identical ones are skipped.
+    """
+
+    def __init__(self, shelf_ids=None, author_ids=None, upsert=False):
+        self.shelf_ids = dict(shelf_ids or {})
+        self.author_ids = dict(author_ids or {})
+        self.upsert = upsert
+
+    def resolve_shelves(self, names):
+        missing = {name for name in names if name not in self.shelf_ids}
+        for chunk in _chunks(missing):
+            self.shelf_ids.update(Shelf.objects.filter(name__in=chunk).values_list('name', 'id'))
+        missing = [name for name in missing if name not in self.shelf_ids]
+        if missing:
+            Shelf.objects.bulk_create([Shelf(name=name) for name in missing], ignore_conflicts=True)
+            for chunk in _chunks(missing):
+                self.shelf_ids.update(Shelf.objects.filter(name__in=chunk).values_list('name', 'id'))
+
+    def resolve_authors(self, names):
+        missing = {name for name in names if name not in self.author_ids}
+        for chunk in _chunks(missing):
+            first_names = {first_name for first_name, _ in chunk}
+            last_names = {last_name for _, last_name in chunk}
+            existing = Author.objects.filter(
+                first_name__in=first_names, last_name__in=last_names
+            ).order_by('-id').values_list('first_name', 'last_name', 'id')
+            # Ordered by descending id so the oldest duplicate author wins
+            for first_name, last_name, author_id in existing:
+                if (first_name, last_name) in missing:
+                    self.author_ids[(first_name, last_name)] = author_id
+        missing = [name for name in missing if name not in self.author_ids]
+        if missing:
+            created = Author.objects.bulk_create([
+                Author(first_name=first_name, last_name=last_name, date_of_birth=None)
+                for first_name, last_name in missing
+            ])
+            for name, author in zip(missing, created):
+                self.author_ids[name] = author.id
+
+    def _write_relations(self, books, records):
+        BookShelf = Book.shelves.through
+        BookAuthor = Book.authors.through
+        BookShelf.objects.bulk_create([
+            BookShelf(book_id=book.id, shelf_id=self.shelf_ids[name])
+            for book, (_, shelf_names, _) in zip(books, records)
+            for name in shelf_names
+        ])
+        BookAuthor.objects.bulk_create([
+            BookAuthor(book_id=book.id, author_id=self.author_ids[name])
+            for book, (_, _, author_names) in zip(books, records)
+            for name in author_names
+        ])
+        update_search_vectors(book.id for book in books)
+
+    def _existing_books(self, records):
+        """Map record keys to ``(id, content_hash)`` of the books already stored under them."""
+        isbn13s = {key for kind, key in map(record_key, records) if kind == 'isbn13'}
+        isbns = {key for kind, key in map(record_key, records) if kind == 'isbn'}
+        existing = {}
+        for chunk in _chunks(isbn13s):
+            for book_id, isbn13, content_hash in Book.objects.filter(isbn13__in=chunk).values_list(
+                'id', 'isbn13', 'content_hash'
+            ):
+                existing[('isbn13', isbn13)] = (book_id, content_hash)
+        for chunk in _chunks(isbns):
+            books = Book.objects.filter(isbn__in=chunk).filter(Q(isbn13__isnull=True) | Q(isbn13=''))
+            for book_id, isbn, content_hash in books.values_list('id', 'isbn', 'content_hash'):
+                existing[('isbn', isbn)] = (book_id, content_hash)
+        return existing
+
+    @transaction.atomic
+    def load(self, records):
+        """
+        Write a batch of parsed records.
+
+        Returns a Counter of ``inserted``, ``updated`` and ``unchanged`` books.
+        Without ``upsert`` every record is inserted.
+        """
+        self.resolve_shelves({name for _, shelf_names, _ in records for name in shelf_names})
+        self.resolve_authors({name for _, _, author_names in records for name in author_names})
+        stats = Counter()
+
+        if not self.upsert:
+            books = Book.objects.bulk_create([
+                Book(content_hash=content_hash(record), **record[0]) for record in records
+            ])
+            self._write_relations(books, records)
+            stats['inserted'] += len(books)
+            return stats
+
+        # The last record wins when a batch repeats a key
+        keyed = {}
+        for index, record in enumerate(records):
+            keyed[record_key(record) or ('row', index)] = record
+        existing = self._existing_books(keyed.values())
+
+        to_insert = []
+        to_update = []
+        now = timezone.now()
+        for key, record in keyed.items():
+            record_hash = content_hash(record)
+            if key not in existing:
+                to_insert.append((Book(content_hash=record_hash, **record[0]), record))
+            elif existing[key][1] == record_hash:
+                stats['unchanged'] += 1
+            else:
+                book = Book(
+                    id=existing[key][0], content_hash=record_hash, similarity_dirty=True, updated_at=now, **record[0]
+                )
+                to_update.append((book, record))
+
+        if to_insert:
+            books = Book.objects.bulk_create([book for book, _ in to_insert])
+            self._write_relations(books, [record for _, record in to_insert])
+            stats['inserted'] += len(books)
+        if to_update:
+            books = [book for book, _ in to_update]
+            Book.objects.bulk_update(books, UPSERT_FIELDS, batch_size=1000)
+            book_ids = [book.id for book in books]
+            Book.shelves.through.objects.filter(book_id__in=book_ids).delete()
+            Book.authors.through.objects.filter(book_id__in=book_ids).delete()
+            self._write_relations(books, [record for _, record in to_update])
+            stats['updated'] += len(books)
+        return stats
+
+    def forget(self):
+        # Drop cached ids that may belong to a rolled back transaction
+        self.shelf_ids.clear()
+        self.author_ids.clear()
+
+    def load_safely(self, records):
+        """
+        Load a batch in one transaction, falling back to one record at a time if it fails.
+
+        Returns ``(stats, errors)`` where ``stats`` counts the written books
+        like ``load`` and ``errors`` lists the failure messages.
+        """
+        try:
+            return self.load(records), []
+        except Exception as e:
+            self.forget()
+            errors = [f'Batch failed ({e}), retrying records one by one']
+
+        stats = Counter()
+        for record in records:
+            try:
+                stats += self.load([record])
+            except Exception as e:
+                self.forget()
+                errors.append(f'Failed to process record: {e}')
+        return stats, errors
+
+
+def detect_format(path):
+    """Return ``'array'`` for a top-level JSON array and ``'jsonl'`` otherwise."""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                return 'jsonl'
+            stripped = chunk.lstrip()
+            if stripped:
+                return 'array' if stripped[:1] == b'[' else 'jsonl'
+
+
+def shard_ranges(path, shards):
+    """Split a file into ``shards`` contiguous byte ranges of similar size."""
+    size = os.path.getsize(path)
+    shards = max(1, min(shards, size or 1))
+    bounds = [size * i // shards for i in range(shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(shards) if bounds[i] < bounds[i + 1]]
+
+
+def iter_jsonl_range(path, start, end):
+    """
+    Yield ``(line, offset)`` for every line that starts inside ``[start, end)``.
+
+    ``offset`` is the byte position just after the line, suitable for resuming.
+    """
+    with open(path, 'rb') as f:
+        if start:
+            # Skip the line straddling the range start; the previous range owns it
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position = f.tell()
+            yield line, position
+
+
+def iter_array_records(path, skip=0):
+    """Stream the items of a top-level JSON array with bounded memory."""
+    with open(path, 'rb') as f:
+        for index, item in enumerate(ijson.items(f, 'item', use_float=True)):
+            if index >= skip:
+                yield item
+
+
+class Checkpoint:
+    """
+    Progress of one input range, stored as a small JSON file.
+
+    ``position`` is the byte offset (JSONL) or record count (JSON array)
+    up to which records have been committed.
+    """
+
+    def __init__(self, directory, name):
+        self.path = os.path.join(directory, f'{name}.json') if directory else None
+
+    def read(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def write(self, position, loaded, done=False):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'position': position, 'loaded': loaded, 'done': done}, f)
+        os.replace(tmp_path, self.path)
+
+
+class ImportCheckpoints:
+    """
+    The checkpoints of one input file in ``directory``, named after the
+    file's path, size and modification time, so another input (or this one
+    once rewritten) never resumes from them. Without a directory every
+    checkpoint is a no-op.
+    """
+
+    def __init__(self, directory, path):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            stat = os.stat(path)
+            key = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+            self.prefix = f'{os.path.basename(path)}.{hashlib.sha1(key.encode()).hexdigest()[:12]}'
+
+    def _checkpoint(self, name):
+        return Checkpoint(self.directory, f'{self.prefix}.{name}' if self.directory else None)
+
+    def array(self):
+        """The checkpoint of a JSON array, counted in records whichever number of workers loads it."""
+        return self._checkpoint('array')
+
+    def ranges(self, ranges):
+        """
+        One checkpoint per JSONL byte range. The layout is recorded with the
+        first run; a resume that splits the file differently (another
+        ``--workers``) is rejected instead of silently starting over.
+        """
+        ranges = [list(bounds) for bounds in ranges]
+        if self.directory:
+            layout_path = os.path.join(self.directory, f'{self.prefix}.layout.json')
+            if os.path.exists(layout_path):
+                with open(layout_path, encoding='utf-8') as f:
+                    layout = json.load(f)
+                if layout != ranges:
+                    raise ValueError(
+                        f'{self.directory} holds checkpoints of this file split into {len(layout)} ranges, '
+                        f'not {len(ranges)}: resume with the same --workers or use another --checkpoint-dir.'
+                    )
+            else:
+                with open(layout_path, 'w', encoding='utf-8') as f:
+                    json.dump(ranges, f)
+        return [self._checkpoint(f'{start}-{end}') for start, end in ranges]
+
+
+def parse_line(line):
+    return parse_record(json.loads(line))
+
+
+def scan_names(records):
+    """Collect the distinct shelf and author names of parsed records."""
+    shelf_names = set()
+    author_names = set()
+    for _, record_shelves, record_authors in records:
+        shelf_names.update(record_shelves)
+        author_names.update(record_authors)
+    return shelf_names, author_names
+
+
+def _parsed_lines(path, start, end):
+    for line, _ in iter_jsonl_range(path, start, end):
+        if line.strip():
+            try:
+                yield parse_line(line)
+            except Exception:
+                continue  # Reported by the load pass
+
+
+def _no_progress(loaded, errors):
+    pass
+
+
+def load_jsonl_range(loader, path, start, end, batch_size=DEFAULT_BATCH_SIZE, checkpoint=None, limit=None,
+                     on_progress=_no_progress):
+    """
+    Load the JSONL lines starting inside ``[start, end)``, resuming from ``checkpoint``.
+
+    ``on_progress(loaded, errors)`` is called after every committed batch
+    with the number of books written so far. Returns ``(stats, errors)``
+    where ``stats`` counts inserted/updated/unchanged books.
+    """
+    checkpoint = checkpoint or Checkpoint(None, None)
+    state = checkpoint.read()
+    if state and state['done']:
+        return Counter(), []
+    if state:
+        start = state['position']
+    loaded = state['loaded'] if state else 0
+    stats = Counter()
+    count = 0
+    errors = []
+    batch = []
+    batch_errors = []
+    position = start
+
+    def flush():
+        nonlocal count, batch, batch_errors
+        batch_stats, load_errors = loader.load_safely(batch)
+        batch_errors.extend(load_errors)
+        stats.update(batch_stats)
+        count = sum(stats.values())
+        errors.extend(batch_errors)
+        on_progress(count, batch_errors)
+        batch = []
+        batch_errors = []
+
+    for line, offset in iter_jsonl_range(path, start, end):
+        if limit is not None and count + len(batch) >= limit:
+            break
+        if line.strip():
+            try:
+                batch.append(parse_line(line))
+            except json.JSONDecodeError as e:
+                batch_errors.append(f'JSONDecodeError: {e}')
+            except Exception as e:
+                batch_errors.append(f'Failed to process record: {e}')
+        position = offset
+        if len(batch) >= batch_size:
+            flush()
+            checkpoint.write(position, loaded + count)
+    if batch or batch_errors:
+        flush()
+    checkpoint.write(position, loaded + count, done=limit is None or count < limit)
+    return stats, errors
+
+
+def _parse_items(items, errors):
+    records = []
+    for item in items:
+        try:
+            records.append(parse_record(item))
+        except Exception as e:
+            errors.append(f'Failed to process record: {e}')
+    return records
+
+
+def _batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_array(loader, path, batch_size=DEFAULT_BATCH_SIZE, checkpoint=None, limit=None, on_progress=_no_progress):
+    """
+    Load the items of a top-level JSON array, resuming from ``checkpoint``.
+
+    Returns ``(stats, errors)`` like ``load_jsonl_range``.
+    """
+    checkpoint = checkpoint or Checkpoint(None, None)
+    state = checkpoint.read() or {'position': 0, 'loaded': 0, 'done': False}
+    if state['done']:
+        return Counter(), []
+    position = state['position']
+    stats = Counter()
+    count = 0
+    errors = []
+    for items in _batches(islice(iter_array_records(path, position), limit), batch_size):
+        batch_errors = []
+        batch_stats, load_errors = loader.load_safely(_parse_items(items, batch_errors))
+        batch_errors.extend(load_errors)
+        stats.update(batch_stats)
+        count = sum(stats.values())
+        position += len(items)
+        errors.extend(batch_errors)
+        checkpoint.write(position, state['loaded'] + count)
+        on_progress(count, batch_errors)
+    checkpoint.write(position, state['loaded'] + count, done=limit is None or count < limit)
+    return stats, errors
+
+
+# Loader shared by the tasks of one pool worker
+_worker_state = {}
+
+
+def _init_worker(shelf_ids, author_ids, upsert, batch_size):
+    _worker_state['loader'] = BookLoader(shelf_ids, author_ids, upsert)
+    _worker_state['batch_size'] = batch_size
+
+
+def _scan_range(bounds):
+    path, start, end = bounds
+    return scan_names(_parsed_lines(path, start, end))
+
+
+def _load_range(task):
+    path, start, end, checkpoint = task
+    return load_jsonl_range(
+        _worker_state['loader'], path, start, end, _worker_state['batch_size'], checkpoint
+    )
+
+
+def _load_records(records):
+    return _worker_state['loader'].load_safely(records)
+
+
+def _pool(workers, initargs=None):
+    # Children must open their own database connections
+    connections.close_all()
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context('fork'),
+        initializer=_init_worker if initargs else None,
+        initargs=initargs or (),
+    )
+
+
+class ParallelImport:
+    """
+    Sharded import of a large JSONL file or JSON array with a process pool.
+
+    A first pass collects every distinct shelf and author name and creates
+    the missing ones in this process, so workers only look up ids and never
+    race to create the same author. JSONL files are then split into byte
+    ranges loaded independently by the workers; JSON arrays are streamed
+    with ijson here and loaded by the workers batch by batch. With a
+    ``checkpoint_dir`` each range (or the array reader) records how far it
+    has committed, and a rerun on the same file with the same number of
+    workers resumes from there.
+    """
+
+    def __init__(self, path, workers, batch_size=DEFAULT_BATCH_SIZE, checkpoint_dir=None, shards_per_worker=8,
+                 input_format='auto', upsert=False, on_progress=None):
+        self.path = path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint_dir = checkpoint_dir
+        self.shards_per_worker = shards_per_worker
+        self.upsert = upsert
+        self.input_format = detect_format(path) if input_format == 'auto' else input_format
+        self.on_progress = on_progress or _no_progress
+        self.checkpoints = ImportCheckpoints(checkpoint_dir, path)
+
+    def resolve_names(self, shelf_names, author_names):
+        loader = BookLoader()
+        with transaction.atomic():
+            loader.resolve_shelves(shelf_names)
+            loader.resolve_authors(author_names)
+        return loader.shelf_ids, loader.author_ids
+
+    def run(self):
+        """Returns ``(stats, errors)`` like ``load_jsonl_range``."""
+        if self.input_format == 'array':
+            return self.run_array()
+        return self.run_jsonl()
+
+    def run_jsonl(self):
+        bounds = shard_ranges(self.path, self.workers * self.shards_per_worker)
+        checkpoints = self.checkpoints.ranges(bounds)
+        ranges = [(self.path, start, end) for start, end in bounds]
+        shelf_names = set()
+        author_names = set()
+        with _pool(self.workers) as executor:
+            for range_shelves, range_authors in executor.map(_scan_range, ranges):
+                shelf_names |= range_shelves
+                author_names |= range_authors
+        shelf_ids, author_ids = self.resolve_names(shelf_names, author_names)
+
+        stats = Counter()
+        errors = []
+        initargs = (shelf_ids, author_ids, self.upsert, self.batch_size)
+        tasks = [(*bounds, checkpoint) for bounds, checkpoint in zip(ranges, checkpoints)]
+        with _pool(self.workers, initargs) as executor:
+            for range_stats, range_errors in executor.map(_load_range, tasks):
+                stats.update(range_stats)
+                errors.extend(range_errors)
+                self.on_progress(sum(stats.values()), range_errors)
+        return stats, errors
+
+    def run_array(self):
+        checkpoint = self.checkpoints.array()
+        state = checkpoint.read() or {'position': 0, 'loaded': 0, 'done': False}
+        if state['done']:
+            return Counter(), []
+        skip = state['position']
+
+        shelf_names = set()
+        author_names = set()
+        for items in _batches(iter_array_records(self.path, skip), self.batch_size):
+            batch_shelves, batch_authors = scan_names(_parse_items(items, []))
+            shelf_names |= batch_shelves
+            author_names |= batch_authors
+        shelf_ids, author_ids = self.resolve_names(shelf_names, author_names)
+
+        stats = Counter()
+        loaded = 0
+        errors = []
+        position = skip
+        in_flight = deque()
+        initargs = (shelf_ids, author_ids, self.upsert, self.batch_size)
+        with _pool(self.workers, initargs) as executor:
+            def collect():
+                nonlocal loaded, position
+                size, future = in_flight.popleft()
+                batch_stats, batch_errors = future.result()
+                stats.update(batch_stats)
+                loaded = sum(stats.values())
+                position += size
+                errors.extend(batch_errors)
+                # Batches are collected in submission order, so everything before position is committed
+                checkpoint.write(position, state['loaded'] + loaded)
+                self.on_progress(loaded, batch_errors)
+
+            for items in _batches(iter_array_records(self.path, skip), self.batch_size):
+                records = _parse_items(items, errors)
+                in_flight.append((len(items), executor.submit(_load_records, records)))
+                # Bound memory by keeping a couple of batches queued per worker
+                if len(in_flight) >= self.workers * 2:
+                    collect()
+            while in_flight:
+                collect()
+        checkpoint.write(position, state['loaded'] + loaded, done=True)
+        return stats, errors
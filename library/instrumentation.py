@@ -0,0 +1,142 @@
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _duration(seconds):
+    if seconds < 60:
+        return f'{seconds:.0f}s'
+    if seconds < 3600:
+        return f'{seconds // 60:.0f}m{seconds % 60:02.0f}s'
+    return f'{seconds // 3600:.0f}h{seconds % 3600 // 60:02.0f}m'
+
+
+class Phase:
+    def __init__(self, name, total=None):
+        self.name = name
+        self.total = total
+        self.rows = 0
+        self.started = time.monotonic()
+        self.seconds = None
+        self.peak_rss_mb = None
+
+    @property
+    def elapsed(self):
+        return self.seconds if self.seconds is not None else time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'seconds': round(self.elapsed, 3),
+            'rows': self.rows,
+            'rows_per_sec': round(self.rate, 1),
+            'peak_rss_mb': self.peak_rss_mb,
+        }
+
+
+class CommandMetrics:
+    """
+    Wall time, rows/sec and peak RSS of each phase of a management command,
+    reported as it runs and optionally saved as JSON for batch schedulers.
+    """
+
+    def __init__(self, command, write):
+        self.command = command
+        self.write = write
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        self.started = time.monotonic()
+        self.phases = []
+        self.current = None
+        self.counters = {}
+        self.status = 'ok'
+        self.error = None
+
+    @contextmanager
+    def phase(self, name, total=None):
+        """Time a phase; ``total`` rows, when known, gives progress lines an ETA."""
+        phase = Phase(name, total)
+        self.phases.append(phase)
+        self.current = phase
+        try:
+            yield phase
+        finally:
+            phase.seconds = time.monotonic() - phase.started
+            phase.peak_rss_mb = peak_rss_mb()
+            self.current = None
+            rows = f', {phase.rows} rows at {phase.rate:.0f} rows/s' if phase.rows else ''
+            self.write(f'Phase {name}: {phase.seconds:.1f}s{rows}, peak RSS {phase.peak_rss_mb} MB.')
+
+    def progress(self, rows):
+        """Record ``rows`` done in the current phase and describe the progress for a log line."""
+        phase = self.current
+        if phase is None:
+            return ''
+        phase.rows = rows
+        parts = [f'{phase.rate:.0f} rows/s']
+        if phase.total and phase.rate and rows < phase.total:
+            parts.append(f'ETA {_duration((phase.total - rows) / phase.rate)}')
+        parts.append(f'peak RSS {peak_rss_mb()} MB')
+        return f'({", ".join(parts)})'
+
+    def fail(self, error):
+        self.status = 'failed'
+        self.error = str(error) or type(error).__name__
+
+    def as_dict(self):
+        return {
+            'command': self.command,
+            'started_at': self.started_at,
+            'status': self.status,
+            'error': self.error,
+            'seconds': round(time.monotonic() - self.started, 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'phases': [phase.as_dict() for phase in self.phases],
+            'counters': self.counters,
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+class InstrumentedCommand(BaseCommand):
+    """
+    A management command with ``self.metrics`` (a CommandMetrics) and a
+    ``--metrics-file`` option that saves them as JSON, also when the command fails.
+    """
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            '--metrics-file',
+            type=str,
+            default=None,
+            help='Write per-phase timing, throughput and memory metrics to this JSON file',
+        )
+        return parser
+
+    def execute(self, *args, **options):
+        self.metrics = CommandMetrics(self.__module__.rsplit('.', 1)[-1], lambda message: self.stdout.write(message))
+        try:
+            return super().execute(*args, **options)
+        except BaseException as e:
+            self.metrics.fail(e)
+            raise
+        finally:
+            if options.get('metrics_file'):
+                self.metrics.save(options['metrics_file'])
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from library.benchmarks import SCENARIOS, BenchmarkRun, run_metadata
+from library_api.celery import app as celery_app
+
+
+class Command(BaseCommand):
+    help = 'Benchmark API hot paths and batch commands on a seeded synthetic catalog in a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--books',
+            type=int,
+            default=5000,
+            help='Size of the synthetic catalog the API scenarios run against',
+        )
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[1000, 5000],
+            help='Catalog sizes compute_similarities is timed at',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Requests timed per API scenario',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=50,
+            help='Users with seeded favorites for the favorites and recommendations scenarios',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='import_books batch size',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of the synthetic catalog and request mix',
+        )
+        parser.add_argument(
+            '--scenario',
+            choices=SCENARIOS,
+            action='append',
+            help='Scenario to run; repeat to run several (default: all)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='benchmark.json',
+            help='Where to write the JSON results',
+        )
+
+    def handle(self, *args, **options):
+        scenarios = options['scenario'] or SCENARIOS
+        if options['books'] < 1 or min(options['sizes']) < 1:
+            raise CommandError('--books and --sizes must be positive.')
+
+        metadata = run_metadata({key: options[key] for key in (
+            'books', 'sizes', 'requests', 'users', 'batch_size', 'seed',
+        )} | {'scenarios': scenarios})
+
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+        always_eager = celery_app.conf.task_always_eager
+        # Refresh tasks run in-process so the favorites scenario includes the recommendation step
+        celery_app.conf.task_always_eager = True
+        try:
+            with tempfile.TemporaryDirectory() as index_dir, override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+                # One process, so the local memory cache is shared by everything the benchmark runs
+                CATALOG_RESPONSE_CACHE=True,
+                SIMILARITY_INDEX_DIR=index_dir,
+                SUGGEST_INDEX_PATH=os.path.join(index_dir, 'suggest.idx'),
+            ):
+                run = BenchmarkRun(
+                    seed=options['seed'],
+                    books=options['books'],
+                    sizes=options['sizes'],
+                    requests=options['requests'],
+                    users=options['users'],
+                    batch_size=options['batch_size'],
+                    log=self.stdout.write,
+                )
+                try:
+                    results = run.run(scenarios)
+                finally:
+                    run.close()
+        finally:
+            celery_app.conf.task_always_eager = always_eager
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump({'metadata': metadata, 'results': results}, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote results of {len(results)} scenarios to {options["output"]}.'))
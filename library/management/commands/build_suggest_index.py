@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from library.suggest import build_index
+
+
+class Command(BaseCommand):
+    help = 'Build the memory-mapped title and author completion index used by /books/suggest/'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            type=str,
+            default=None,
+            help='Where to write the snapshot (defaults to SUGGEST_INDEX_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.SUGGEST_INDEX_PATH
+        started = time.monotonic()
+        count = build_index(path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully indexed {count} titles and author names in {time.monotonic() - started:.1f}s ({path}).'
+        ))
@@ -1,30 +1,59 @@
-from django.core.management.base import BaseCommand
-from library.models import Book, Author
-from django.db import transaction
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from library.bulk import clear_tables
+from library.caching import invalidate_catalog
+from library.instrumentation import InstrumentedCommand
+from library.models import Author, Book, BookSimilarity, Favorite, SimilarityGeneration
+from library.neighbours import remove_table
+from library.recommendations import invalidate_all_recommendations
 
-class Command(BaseCommand):
-    help = 'Delete all entries from Book and Author models.'
+# Dependants first; shelves and users are kept
+TABLES = [
+    Favorite,
+    BookSimilarity,
+    SimilarityGeneration,
+    Book.authors.through,
+    Book.shelves.through,
+    Book,
+    Author,
+]
+
+
+class Command(InstrumentedCommand):
+    help = 'Delete all books and authors, with their favorites, similarities and M2M links.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--noinput',
+            '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not prompt for confirmation',
+        )
 
     def handle(self, *args, **options):
-        confirm = input("Are you sure you want to delete all Book and Author entries? Type 'yes' to confirm: ")
-        if confirm.lower() != 'yes':
-            self.stdout.write(self.style.WARNING("Operation cancelled. No data was deleted."))
-            return
+        if options['interactive']:
+            confirm = input("Are you sure you want to delete all Book and Author entries? Type 'yes' to confirm: ")
+            if confirm.lower() != 'yes':
+                self.stdout.write(self.style.WARNING("Operation cancelled. No data was deleted."))
+                return
 
         try:
-            with transaction.atomic():
-                # Clear ManyToMany relationships
-                for book in Book.objects.all():
-                    book.authors.clear()
-
-                # Delete all Book and Author entries
-                book_count = Book.objects.count()
-                author_count = Author.objects.count()
+            book_count = Book.objects.count()
+            author_count = Author.objects.count()
+            with self.metrics.phase('delete') as phase:
+                clear_tables(TABLES)
+                phase.rows = book_count + author_count
+            invalidate_catalog()
+            invalidate_all_recommendations()
 
-                Book.objects.all().delete()
-                Author.objects.all().delete()
+            with self.metrics.phase('indexes'):
+                remove_table()
+                call_command('build_suggest_index', stdout=self.stdout, stderr=self.stderr)
 
+            self.metrics.counters.update(books=book_count, authors=author_count)
             self.stdout.write(self.style.SUCCESS(f"Successfully deleted {book_count} Book entries and {author_count} Author entries."))
 
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f"An error occurred: {str(e)}"))
+            # Recorded in the metrics as a failure, and a non-zero exit status from manage.py
+            raise CommandError(f"An error occurred: {e}") from e
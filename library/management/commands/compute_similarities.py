@@ -1,70 +1,358 @@
-from django.core.management.base import BaseCommand
-from library.models import Book, BookSimilarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from django.db import transaction
+import os
 
-class Command(BaseCommand):
+import numpy as np
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db.models import Count, Min
+from django.utils import timezone
+from library.bulk import copy_rows, stage_rows, update_from_staged
+from library.instrumentation import InstrumentedCommand
+from library.models import Book, BookSimilarity, SimilarityGeneration
+from library.neighbours import NeighbourTableWriter, replace_rows, snapshot_path
+from library.recommendations import invalidate_all_recommendations
+from library.similarity import (
+    DEFAULT_BLOCK_SIZE,
+    MAX_SIMILARS,
+    book_document,
+    load_vectorizer,
+    load_book_vectors,
+    save_vectorizer,
+    score_rows,
+    pack_vector,
+    vectorize,
+)
+from library.similarity_backends import BACKENDS, DEFAULT_DIMENSIONS, get_backend, recall_at_k, sample_rows
+from django.db import connection, transaction
+
+# Chunk size for id__in lookups and bulk updates
+BATCH_SIZE = 5000
+
+SIMILARITY_FIELDS = ('generation_id', 'book1_id', 'book2_id', 'similarity')
+
+
+def vectorizer_path():
+    return os.path.join(settings.SIMILARITY_INDEX_DIR, 'vectorizer.joblib')
+
+
+def move_into_place(staged):
+    for staged_path, path in staged:
+        os.replace(staged_path, path)
+
+
+def chunked(items, size=BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class Command(InstrumentedCommand):
     help = 'Compute and store book similarities using vectorization'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only recompute neighbour lists affected by new or edited books',
+        )
+        parser.add_argument(
+            '--backend',
+            choices=sorted(BACKENDS),
+            default='exact',
+            help='Similarity backend: exact scoring or an approximate nearest-neighbour index',
+        )
+        parser.add_argument(
+            '--block-size',
+            type=int,
+            default=DEFAULT_BLOCK_SIZE,
+            help='Number of books scored per block (bounds peak memory)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes used to score blocks (exact backend)',
+        )
+        parser.add_argument(
+            '--dimensions',
+            type=int,
+            default=DEFAULT_DIMENSIONS,
+            help='Dimensions of the reduced vectors indexed by the faiss/annoy backends',
+        )
+        parser.add_argument(
+            '--index-path',
+            type=str,
+            default=None,
+            help='Where to save the faiss/annoy index (defaults to SIMILARITY_INDEX_DIR)',
+        )
+        parser.add_argument(
+            '--recall-sample',
+            type=int,
+            default=200,
+            help='Books sampled to report recall@K of approximate backends against exact (0 to skip)',
+        )
+        parser.add_argument(
+            '--min-recall',
+            type=float,
+            default=None,
+            help='Sampled recall@K below which an approximate run is not published (defaults to SIMILARITY_MIN_RECALL)',
+        )
+
     def handle(self, *args, **options):
-        self.stdout.write('Fetching book data...')
-        books = Book.objects.all()
-        total_books = books.count()
-        self.stdout.write(f'Total books: {total_books}')
-
-        # Clear existing similarities
-        BookSimilarity.objects.all().delete()
-
-        # Prepare data for vectorization
-        self.stdout.write('Preparing data for vectorization...')
-        book_ids = []
-        documents = []  # Each document represents a book's features
-
-        for book in books:
-            book_ids.append(book.id)
-            authors = ' '.join([f'{author.first_name}_{author.last_name}' for author in book.authors.all()])
-            shelves = ' '.join([shelf.name.replace(' ', '_') for shelf in book.shelves.all()])
-            # Combine features
-            document = f'{authors} {shelves}'
-            documents.append(document)
-
-        self.stdout.write('Vectorizing documents...')
-        # Use TF-IDF Vectorizer
-        vectorizer = TfidfVectorizer()
-        tfidf_matrix = vectorizer.fit_transform(documents)
-
-        self.stdout.write('Computing cosine similarity matrix...')
-        # Compute cosine similarity matrix
-        cosine_sim = cosine_similarity(tfidf_matrix)
-
-        # For each book, find top N similar books
-        MAX_SIMILARS = 50  # Adjust as necessary
-
-        self.stdout.write('Storing similarities...')
-        similarities_to_create = []
-        for idx, book_id in enumerate(book_ids):
-            # Get similarity scores for the current book
-            sim_scores = cosine_sim[idx]
-            # Get indices of the top similar books (excluding itself)
-            similar_indices = sim_scores.argsort()[::-1][1:MAX_SIMILARS+1]
-            for sim_idx in similar_indices:
-                similar_book_id = book_ids[sim_idx]
-                similarity = sim_scores[sim_idx]
-                if similarity > 0:
-                    similarities_to_create.append(
-                        BookSimilarity(
-                            book1_id=book_id,
-                            book2_id=similar_book_id,
-                            similarity=similarity
-                        )
+        if options['incremental']:
+            if options['backend'] != 'exact':
+                raise CommandError('--incremental only supports the exact backend.')
+            return self.handle_incremental(options['block_size'])
+
+        backend_name = options['backend']
+        block_size = options['block_size']
+        workers = options['workers']
+
+        with self.metrics.phase('fetch') as phase:
+            self.stdout.write('Fetching book data...')
+            # Books saved after this are left dirty for the next incremental run
+            fetched_at = timezone.now()
+            books = Book.objects.prefetch_related('authors', 'shelves').order_by('id')
+            total_books = books.count()
+            self.stdout.write(f'Total books: {total_books}')
+
+            # Prepare data for vectorization
+            self.stdout.write('Preparing data for vectorization...')
+            book_list = list(books)
+            book_ids = [book.id for book in book_list]
+            documents = [book_document(book) for book in book_list]  # Each document represents a book's features
+            phase.rows = len(book_ids)
+
+        if not book_ids:
+            self.stdout.write(self.style.WARNING('No books to process.'))
+            return
+
+        with self.metrics.phase('vectorize') as phase:
+            self.stdout.write('Vectorizing documents...')
+            # Use TF-IDF Vectorizer
+            vectorizer, tfidf_matrix = vectorize(documents)
+            # Stored only once the generation they were scored with is published
+            vectors = [pack_vector(tfidf_matrix[row]) for row in range(len(book_ids))]
+            phase.rows = len(book_list)
+            del book_list
+
+        index_path = options['index_path']
+        if backend_name != 'exact' and index_path is None:
+            index_path = os.path.join(settings.SIMILARITY_INDEX_DIR, f'books.{backend_name}')
+        backend = get_backend(
+            backend_name,
+            k=MAX_SIMILARS,
+            block_size=block_size,
+            workers=workers,
+            dimensions=options['dimensions'],
+            index_path=index_path,
+            book_ids=book_ids,
+        )
+
+        recall_rows = set()
+        if backend_name != 'exact' and options['recall_sample'] > 0:
+            recall_rows = set(sample_rows(len(book_ids), options['recall_sample']).tolist())
+        approximate = {}
+
+        # Write into a new generation; readers keep using the active one until it is switched
+        generation = SimilarityGeneration.objects.create()
+        neighbours = NeighbourTableWriter()
+        book_id_array = np.asarray(book_ids)
+
+        # For each book, find top N similar books, one block of rows at a time
+        self.stdout.write(
+            f'Computing similarities with the {backend_name} backend in blocks of {block_size} books...'
+        )
+        try:
+            with self.metrics.phase('score', total=len(book_ids)):
+                for start, results in backend.iter_top_k(tfidf_matrix):
+                    for offset, (similar_indices, _) in enumerate(results):
+                        if start + offset in recall_rows:
+                            approximate[start + offset] = similar_indices
+                    copy_rows(
+                        BookSimilarity, SIMILARITY_FIELDS, self.similarity_rows(generation, book_ids, start, results)
+                    )
+                    neighbours.add_rows(
+                        book_id_array[start:start + len(results)],
+                        [book_id_array[similar_indices] for similar_indices, _ in results],
+                        [scores for _, scores in results],
                     )
-            if idx % 100 == 0:
-                self.stdout.write(f'Processed {idx} books...')
+                    processed = start + len(results)
+                    self.stdout.write(f'Processed {processed} books... {self.metrics.progress(processed)}')
+        except ImportError as e:
+            self.discard(generation, backend.staged)
+            raise CommandError(f'The {backend_name} backend is not available: {e}')
+        except BaseException:
+            self.discard(generation, backend.staged)
+            raise
 
-        # Bulk create all similarities
-        self.stdout.write('Bulk creating similarities...')
-        with transaction.atomic():
-            BookSimilarity.objects.bulk_create(similarities_to_create, batch_size=10000)
+        if approximate:
+            recall = recall_at_k(tfidf_matrix, approximate, k=MAX_SIMILARS)
+            self.stdout.write(f'Recall@{MAX_SIMILARS} against exact on {len(approximate)} books: {recall:.3f}')
+            min_recall = options['min_recall']
+            if min_recall is None:
+                min_recall = settings.SIMILARITY_MIN_RECALL
+            if recall < min_recall:
+                self.discard(generation, backend.staged)
+                raise CommandError(
+                    f'Recall@{MAX_SIMILARS} of the {backend_name} backend is {recall:.3f}, below {min_recall}; '
+                    'readers keep the active generation.'
+                )
+
+        with self.metrics.phase('publish'):
+            self.publish(generation, vectorizer, book_ids, vectors, backend.staged, fetched_at)
+            neighbours.write()
+            invalidate_all_recommendations()
+            self.stdout.write(f'Switched readers to similarity generation {generation.pk}.')
+            self.stdout.write(f'Saved neighbour table to {snapshot_path()}')
+
+        if index_path and backend_name != 'exact':
+            self.stdout.write(f'Saved {backend_name} index to {index_path}')
 
         self.stdout.write(self.style.SUCCESS('Successfully computed and stored book similarities.'))
+
+    def discard(self, generation, staged):
+        """Drop an unpublished generation and the index files staged for it."""
+        generation.discard()
+        for staged_path, _ in staged:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+
+    def publish(self, generation, vectorizer, book_ids, vectors, staged, fetched_at):
+        """
+        Activate ``generation`` and, in the same transaction, store the book
+        vectors and vectorizer it was scored with and mark those books clean,
+        so incremental runs always start from the published state. Books saved
+        since ``fetched_at`` keep their vector and stay dirty. The vectors are
+        loaded into a staging table beforehand, so the swap applies them with
+        one statement; the vectorizer and the ``(staged, live)`` index files
+        are moved into place once the transaction commits.
+
+        Generations older than the one this swap retires are discarded under
+        the swap lock. The retired one stays until the next swap, and those
+        created since belong to runs still in progress.
+        """
+        os.makedirs(settings.SIMILARITY_INDEX_DIR, exist_ok=True)
+        path = vectorizer_path()
+        save_vectorizer(vectorizer, f'{path}.new')
+        staged = [(f'{path}.new', path), *staged]
+        try:
+            table = stage_rows(
+                Book,
+                ['tfidf_vector', 'similarity_dirty'],
+                ((book_id, vector, False) for book_id, vector in zip(book_ids, vectors)),
+            )
+            with transaction.atomic():
+                previous = generation.activate()
+                if previous is not None:
+                    for old_generation in SimilarityGeneration.objects.filter(is_active=False, pk__lt=previous.pk):
+                        old_generation.discard()
+                update_from_staged(
+                    Book,
+                    ['tfidf_vector', 'similarity_dirty'],
+                    table,
+                    where=f'{connection.ops.quote_name(Book._meta.db_table)}.updated_at <= %s',
+                    params=[connection.ops.adapt_datetimefield_value(fetched_at)],
+                )
+                transaction.on_commit(lambda: move_into_place(staged))
+        except BaseException:
+            for staged_path, _ in staged:
+                os.remove(staged_path)
+            raise
+
+    def similarity_rows(self, generation, book_ids, start, results):
+        for offset, (similar_indices, scores) in enumerate(results):
+            book_id = book_ids[start + offset]
+            for sim_idx, similarity in zip(similar_indices, scores):
+                yield generation.pk, book_id, book_ids[sim_idx], float(similarity)
+
+    def handle_incremental(self, block_size):
+        try:
+            vectorizer = load_vectorizer(vectorizer_path())
+        except FileNotFoundError:
+            raise CommandError('No saved vectorizer found. Run a full compute_similarities first.')
+
+        generation = SimilarityGeneration.objects.filter(is_active=True).first()
+        if generation is None:
+            raise CommandError('No active similarity generation found. Run a full compute_similarities first.')
+
+        dirty_books = list(Book.objects.filter(similarity_dirty=True).prefetch_related('authors', 'shelves'))
+        self.stdout.write(f'Books to update: {len(dirty_books)}')
+        if not dirty_books:
+            self.stdout.write(self.style.SUCCESS('Book similarities are up to date.'))
+            return
+
+        # Transform new and edited books with the saved vocabulary, without refitting
+        with self.metrics.phase('vectorize') as phase:
+            dirty_matrix = vectorizer.transform([book_document(book) for book in dirty_books])
+            for row, book in enumerate(dirty_books):
+                book.tfidf_vector = pack_vector(dirty_matrix[row])
+                book.similarity_dirty = False
+            phase.rows = len(dirty_books)
+
+        # Edits to the active generation are committed together, so readers see old or new lists, never a mix
+        with transaction.atomic():
+            Book.objects.bulk_update(dirty_books, ['tfidf_vector', 'similarity_dirty'], batch_size=1000)
+
+            with self.metrics.phase('candidates') as phase:
+                self.stdout.write('Loading stored book vectors...')
+                book_ids, tfidf_matrix = load_book_vectors(len(vectorizer.vocabulary_))
+                matrix_t = tfidf_matrix.T.tocsr()
+                row_of = {book_id: row for row, book_id in enumerate(book_ids)}
+
+                dirty_ids = [book.id for book in dirty_books]
+                dirty_rows = np.array([row_of[book_id] for book_id in dirty_ids], dtype=np.intp)
+
+                # Books whose top-K list may gain a changed book
+                best_scores = np.zeros(len(book_ids))
+                for rows in chunked(dirty_rows, block_size):
+                    scores = (tfidf_matrix[rows] @ matrix_t).toarray()
+                    best_scores = np.maximum(best_scores, scores.max(axis=0))
+                best_scores[dirty_rows] = 0
+                candidate_ids = [book_ids[row] for row in np.flatnonzero(best_scores > 0)]
+                current = {}
+                for ids in chunked(candidate_ids):
+                    current.update(
+                        (item['book1_id'], item)
+                        for item in generation.similarities.filter(book1_id__in=ids).values('book1_id').annotate(
+                            count=Count('id'), min_similarity=Min('similarity')
+                        )
+                    )
+                affected = set(dirty_ids)
+                for book_id in candidate_ids:
+                    stats = current.get(book_id)
+                    if (
+                        stats is None
+                        or stats['count'] < MAX_SIMILARS
+                        or best_scores[row_of[book_id]] > stats['min_similarity']
+                    ):
+                        affected.add(book_id)
+
+                # Books whose top-K list currently holds a changed book
+                for ids in chunked(dirty_ids):
+                    affected.update(
+                        generation.similarities.filter(book2_id__in=ids).values_list('book1_id', flat=True)
+                    )
+                phase.rows = len(book_ids)
+
+            affected_ids = sorted(affected)
+            self.stdout.write(f'Recomputing neighbour lists for {len(affected_ids)} books...')
+            with self.metrics.phase('score', total=len(affected_ids)):
+                for ids in chunked(affected_ids):
+                    generation.similarities.filter(book1_id__in=ids).delete()
+                book_id_array = np.asarray(book_ids)
+                updates = {}
+                for ids in chunked(affected_ids, block_size):
+                    rows = np.array([row_of[book_id] for book_id in ids], dtype=np.intp)
+                    results = score_rows(tfidf_matrix, matrix_t, rows)
+                    for book_id, (similar_indices, scores) in zip(ids, results):
+                        updates[book_id] = (book_id_array[similar_indices], scores)
+                    copy_rows(BookSimilarity, SIMILARITY_FIELDS, (
+                        (generation.pk, book_id, book_ids[sim_idx], float(similarity))
+                        for book_id, (similar_indices, scores) in zip(ids, results)
+                        for sim_idx, similarity in zip(similar_indices, scores)
+                    ))
+                    self.stdout.write(f'Processed {len(updates)} books... {self.metrics.progress(len(updates))}')
+
+        with self.metrics.phase('publish'):
+            replace_rows(updates)
+            invalidate_all_recommendations()
+        self.stdout.write(self.style.SUCCESS(f'Updated similarities for {len(affected_ids)} books.'))
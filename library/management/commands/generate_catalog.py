@@ -0,0 +1,110 @@
+import time
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from library.caching import invalidate_catalog
+from library.importer import DEFAULT_BATCH_SIZE, BookLoader, parse_record
+from library.models import Book, Favorite, User
+from library.synthetic import CatalogGenerator, isbn13, write_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Generate a seeded synthetic catalog, as a JSONL file for import_books or straight into the database'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument(
+            '--output',
+            type=str,
+            help='Write the books to this JSON Lines file',
+        )
+        target.add_argument(
+            '--database',
+            action='store_true',
+            help='Insert the books, users and favorites into the database in bulk',
+        )
+        parser.add_argument('--books', type=int, default=100000, help='Number of books')
+        parser.add_argument('--authors', type=int, default=20000, help='Size of the (Zipf-weighted) author pool')
+        parser.add_argument('--shelves', type=int, default=500, help='Size of the (power-law weighted) shelf pool')
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=0,
+            help='Users to create, each with up to 20 favorites of popular books (requires --database)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed; the same options always give the same catalog')
+        parser.add_argument(
+            '--start',
+            type=int,
+            default=0,
+            help='Index of the first record, to extend a catalog generated earlier with the same seed',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Rows inserted per transaction (--database)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Processes generating records in parallel (--output)',
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] and not options['database']:
+            raise CommandError('--users requires --database: import_books only reads books.')
+        if min(options['books'], options['authors'], options['shelves']) < 1:
+            raise CommandError('--books, --authors and --shelves must be positive.')
+        pools = {'authors': options['authors'], 'shelves': options['shelves']}
+        started = time.monotonic()
+
+        if options['output']:
+            write_jsonl(
+                options['output'], options['books'], options['seed'], options['start'], options['workers'], **pools
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Successfully wrote {options['books']} books to {options['output']} "
+                f'in {time.monotonic() - started:.1f}s.'
+            ))
+            return
+
+        generator = CatalogGenerator(options['seed'], **pools)
+        loader = BookLoader()
+        written = 0
+        records = generator.records(options['books'], options['start'])
+        while batch := list(islice(records, options['batch_size'])):
+            written += loader.load([parse_record(record) for record in batch])['inserted']
+            self.stdout.write(f'Inserted {written} books...')
+        favorites = self.create_users(generator, options['users'], options['books'], options['start'])
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully inserted {written} books, {options['users']} users and {favorites} favorites "
+            f'in {time.monotonic() - started:.1f}s.'
+        ))
+        call_command('build_suggest_index', stdout=self.stdout, stderr=self.stderr)
+
+    def create_users(self, generator, users, books, start):
+        """Create ``users`` users and their favorites in batches; returns the number of favorites."""
+        password = make_password(None)
+        count = 0
+        favorites = generator.favorites(users, books)
+        while batch := list(islice(favorites, 1000)):
+            created = User.objects.bulk_create([
+                User(username=f'reader{generator.seed}-{user}', password=password) for user, _ in batch
+            ], ignore_conflicts=True)
+            user_ids = dict(User.objects.filter(username__in=[user.username for user in created]).values_list(
+                'username', 'id'
+            ))
+            isbns = {isbn13(start + index) for _, indexes in batch for index in indexes}
+            book_ids = dict(Book.objects.filter(isbn13__in=isbns).values_list('isbn13', 'id'))
+            rows = Favorite.objects.bulk_create([
+                Favorite(user_id=user_ids[f'reader{generator.seed}-{user}'], book_id=book_ids[isbn13(start + index)])
+                for user, indexes in batch
+                for index in indexes
+            ], ignore_conflicts=True)
+            count += len(rows)
+        return count
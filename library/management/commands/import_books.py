@@ -1,119 +1,130 @@
-import json
-from django.core.management.base import BaseCommand
-from library.models import Book, Author,Shelf
-from django.db import transaction
+import os
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from library.caching import invalidate_catalog
+from library.instrumentation import InstrumentedCommand
+from library.importer import (
+    DEFAULT_BATCH_SIZE,
+    BookLoader,
+    ImportCheckpoints,
+    ParallelImport,
+    detect_format,
+    load_array,
+    load_jsonl_range,
+)
 
-class Command(BaseCommand):
-    help = 'Load books from a JSON Lines file into the database'
+# Default number of records loaded by a single-process import
+DEFAULT_LIMIT = 10000
+
+class Command(InstrumentedCommand):
+    help = 'Load books from a JSON Lines file (or a JSON array) into the database'
 
     def add_arguments(self, parser):
         parser.add_argument('json_file', type=str, help='Path to the JSON file')
         parser.add_argument(
             '--limit',
             type=int,
-            default=10000,
-            help='Number of records to load',
+            default=None,
+            help=f'Number of records to load (default {DEFAULT_LIMIT}; not supported with --workers)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of records inserted per transaction',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['auto', 'jsonl', 'array'],
+            default='auto',
+            help='Input format: JSON Lines or a top-level JSON array (detected by default)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes loading byte-range shards of the input',
+        )
+        parser.add_argument(
+            '--checkpoint-dir',
+            type=str,
+            default=None,
+            help='Directory recording committed offsets so an interrupted import of the same file can resume '
+                 '(with the same --workers)',
+        )
+        parser.add_argument(
+            '--upsert',
+            action='store_true',
+            help='Update books matched on isbn13 (or isbn) instead of inserting duplicates',
+        )
+        parser.add_argument(
+            '--update-similarities',
+            action='store_true',
+            help='Run compute_similarities --incremental for the imported books afterwards',
         )
 
     def handle(self, *args, **options):
         json_file = options['json_file']
-        limit = options['limit']
-        count = 0
+        workers = options['workers']
+        batch_size = options['batch_size']
+        checkpoint_dir = options['checkpoint_dir']
+        input_format = options['format']
+        upsert = options['upsert']
 
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if count >= limit:
-                        break
-                    line = line.strip()
-                    if not line:
-                        continue  # Skip empty lines
-                    try:
-                        item = json.loads(line)
-                        self.process_record(item)
-                        count += 1
-                        if count % 100 == 0:
-                            self.stdout.write(f'Loaded {count} records...')
-                    except json.JSONDecodeError as e:
-                        self.stderr.write(self.style.ERROR(f'JSONDecodeError: {e}'))
-            self.stdout.write(self.style.SUCCESS(f'Successfully loaded {count} records.'))
-        except Exception as e:
-            self.stderr.write(self.style.ERROR(f'Error: {e}'))
+        if workers > 1 and options['limit'] is not None:
+            raise CommandError('--limit is not supported with --workers.')
+        limit = options['limit'] if options['limit'] is not None else DEFAULT_LIMIT
 
-    @transaction.atomic
-    def process_record(self, item):
         try:
-            # Extract data from JSON item
-            book_title = item.get('title', 'Unknown Title')
-            book_isbn = item.get('isbn', None)
-            book_isbn13 = item.get('isbn13', None)
-            book_language = item.get('language', 'Unknown Language')
-
-            # Handle average_rating
-            book_average_rating_raw = item.get('average_rating', None)
-            try:
-                book_average_rating = float(book_average_rating_raw) if book_average_rating_raw else None
-            except ValueError:
-                book_average_rating = None
-
-            book_format = item.get('format', 'Unknown Format')
-
-            # Handle num_pages
-            book_num_pages_raw = item.get('num_pages', None)
-            try:
-                book_num_pages = int(book_num_pages_raw) if book_num_pages_raw else None
-            except ValueError:
-                book_num_pages = None
-
-            book_publisher = item.get('publisher', 'Unknown Publisher')
-            book_publication_date = item.get('publication_date', None)
-            book_description = item.get('description', '')
-            book_image_url = item.get('image_url', '')
-            # Handle shelves
-            shelves_data = item.get('shelves', [])
-            shelves = []
-            for shelf_data in shelves_data:
-                shelf_name = shelf_data.get('name', '').lower()
-                if shelf_name:
-                    shelf, _ = Shelf.objects.get_or_create(name=shelf_name)
-                    shelves.append(shelf)
-
-            # Handle authors
-            authors_data = item.get('authors', [])
-            authors = []
-            for author_data in authors_data:
-                full_name = author_data.get('name', 'Unknown Author')
-                name_parts = full_name.strip().split(' ', 1)
-                if len(name_parts) == 2:
-                    first_name, last_name = name_parts
+            if input_format == 'auto':
+                input_format = detect_format(json_file)
+            with self.metrics.phase('load', total=options['limit']):
+                if workers > 1:
+                    importer = ParallelImport(
+                        json_file,
+                        workers,
+                        batch_size=batch_size,
+                        checkpoint_dir=checkpoint_dir,
+                        input_format=input_format,
+                        upsert=upsert,
+                        on_progress=self.report_progress,
+                    )
+                    stats, _ = importer.run()
                 else:
-                    first_name = name_parts[0]
-                    last_name = ''
-                author_id = author_data.get('id', None)
-                author, created = Author.objects.get_or_create(
-                    first_name=first_name,
-                    last_name=last_name,
-                    defaults={'date_of_birth': None}
-                )
-                authors.append(author)
+                    checkpoints = ImportCheckpoints(checkpoint_dir, json_file)
+                    loader = BookLoader(upsert=upsert)
+                    if input_format == 'array':
+                        stats, _ = load_array(
+                            loader, json_file, batch_size, checkpoints.array(), limit, on_progress=self.report_progress
+                        )
+                    else:
+                        size = os.path.getsize(json_file)
+                        [checkpoint] = checkpoints.ranges([(0, size)])
+                        stats, _ = load_jsonl_range(
+                            loader, json_file, 0, size, batch_size, checkpoint, limit,
+                            on_progress=self.report_progress,
+                        )
+            count = sum(stats.values())
+            self.metrics.counters.update(stats)
+            self.stdout.write(self.style.SUCCESS(
+                f"Successfully loaded {count} records "
+                f"({stats['inserted']} inserted, {stats['updated']} updated, {stats['unchanged']} unchanged)."
+            ))
+        except Exception as e:
+            # Recorded in the metrics as a failure, and a non-zero exit status from manage.py
+            raise CommandError(f'Import failed: {e}') from e
 
-            # Create the book
-            book = Book.objects.create(
-                title=book_title,
-                isbn=book_isbn,
-                isbn13=book_isbn13,
-                language=book_language,
-                average_rating=book_average_rating,
-                book_format=book_format,
-                num_pages=book_num_pages,
-                publisher=book_publisher,
-                publication_date=book_publication_date,
-                description=book_description,
-                image_url=book_image_url
-            )
-            book.shelves.set(shelves)
-            # Associate authors with the book
-            book.authors.set(authors)
+        if not stats['inserted'] + stats['updated']:
+            return
+        invalidate_catalog()
+        # A bulk load touches too many rows for the delta segment; rebuild the completion index once
+        with self.metrics.phase('suggest_index'):
+            call_command('build_suggest_index', stdout=self.stdout, stderr=self.stderr)
+        if options['update_similarities']:
+            with self.metrics.phase('similarities'):
+                call_command('compute_similarities', incremental=True, stdout=self.stdout, stderr=self.stderr)
 
-        except Exception as e:
-            self.stderr.write(self.style.ERROR(f'Failed to process record: {e}'))
+    def report_progress(self, loaded, errors):
+        for error in errors:
+            self.stderr.write(self.style.ERROR(error))
+        self.stdout.write(f'Loaded {loaded} records... {self.metrics.progress(loaded)}')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from library.models import Book
+from library.search import UPDATE_BATCH_SIZE, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search vectors of all books (PostgreSQL only)'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(self.style.WARNING('Search vectors are only stored on PostgreSQL; nothing to do.'))
+            return
+
+        book_ids = list(Book.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(book_ids), UPDATE_BATCH_SIZE):
+            update_search_vectors(book_ids[start:start + UPDATE_BATCH_SIZE])
+            self.stdout.write(f'Indexed {min(start + UPDATE_BATCH_SIZE, len(book_ids))} books...')
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt search vectors for {len(book_ids)} books.'))
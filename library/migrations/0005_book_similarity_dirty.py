@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_alter_favorite_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='similarity_dirty',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+    ]
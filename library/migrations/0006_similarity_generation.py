@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_book_similarity_dirty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('completed_on', models.DateTimeField(blank=True, null=True)),
+                ('is_active', models.BooleanField(db_index=True, default=False)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='booksimilarity',
+            name='library_boo_book1_i_2d30d3_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='similaritygeneration',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='unique_active_similarity_generation'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='booksimilarity',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='booksimilarity',
+            name='generation',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='library.similaritygeneration'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='booksimilarity',
+            unique_together={('generation', 'book1', 'book2')},
+        ),
+        migrations.AddIndex(
+            model_name='booksimilarity',
+            index=models.Index(fields=['generation', 'book1', 'similarity'], name='library_boo_generat_1e78d2_idx'),
+        ),
+    ]
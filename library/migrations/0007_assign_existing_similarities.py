@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def assign_existing_similarities(apps, schema_editor):
+    SimilarityGeneration = apps.get_model('library', 'SimilarityGeneration')
+    BookSimilarity = apps.get_model('library', 'BookSimilarity')
+    if not BookSimilarity.objects.filter(generation__isnull=True).exists():
+        return
+    generation = SimilarityGeneration.objects.create(completed_on=timezone.now(), is_active=True)
+    BookSimilarity.objects.filter(generation__isnull=True).update(generation=generation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_similarity_generation'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_existing_similarities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_assign_existing_similarities'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booksimilarity',
+            name='generation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='library.similaritygeneration'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.models import Count, Q
+
+
+def merge_duplicate_books(apps, schema_editor):
+    """
+    Keep the oldest book for every duplicated isbn13 (or isbn when there is no
+    isbn13) so the upsert keys can be made unique. Favorites move to the kept
+    book; similarities of removed duplicates are dropped with them.
+    """
+    Book = apps.get_model('library', 'Book')
+    Favorite = apps.get_model('library', 'Favorite')
+    without_isbn13 = Q(isbn13__isnull=True) | Q(isbn13='')
+    keys = [
+        ('isbn13', Book.objects.filter(isbn13__gt='')),
+        ('isbn', Book.objects.filter(without_isbn13, isbn__gt='')),
+    ]
+    for field, books in keys:
+        duplicated = books.values(field).annotate(count=Count('id')).filter(count__gt=1).values_list(field, flat=True)
+        for value in list(duplicated):
+            ids = list(books.filter(**{field: value}).order_by('id').values_list('id', flat=True))
+            keep, duplicates = ids[0], ids[1:]
+            users = set(Favorite.objects.filter(book_id=keep).values_list('user_id', flat=True))
+            for favorite in Favorite.objects.filter(book_id__in=duplicates).order_by('added_on'):
+                if favorite.user_id in users:
+                    favorite.delete()
+                else:
+                    users.add(favorite.user_id)
+                    favorite.book_id = keep
+                    favorite.save(update_fields=['book'])
+            Book.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_booksimilarity_generation_required'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_books, migrations.RunPython.noop),
+    ]
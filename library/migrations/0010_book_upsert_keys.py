@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_merge_duplicate_books'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(condition=models.Q(('isbn13__gt', '')), fields=('isbn13',), name='unique_book_isbn13'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(condition=models.Q(('isbn__gt', ''), models.Q(('isbn13__isnull', True), ('isbn13', ''), _connector='OR')), fields=('isbn',), name='unique_book_isbn_without_isbn13'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:25
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    On PostgreSQL, enable pg_trgm, index search_vector and title with GIN and
+    fill search_vector for existing books. Other databases use the portable
+    search backend and need nothing here.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS library_book_search_vector_gin ON library_book USING gin (search_vector)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS library_book_title_trgm ON library_book USING gin (title gin_trgm_ops)'
+    )
+    schema_editor.execute("""
+        UPDATE library_book SET search_vector =
+            setweight(to_tsvector('english', coalesce(library_book.title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce((
+                SELECT string_agg(a.first_name || ' ' || a.last_name, ' ')
+                FROM library_book_authors ba JOIN library_author a ON a.id = ba.author_id
+                WHERE ba.book_id = library_book.id
+            ), '')), 'B')
+            || setweight(to_tsvector('english', coalesce((
+                SELECT string_agg(s.name, ' ')
+                FROM library_book_shelves bs JOIN library_shelf s ON s.id = bs.shelf_id
+                WHERE bs.book_id = library_book.id
+            ), '')), 'C')
+            || setweight(to_tsvector('english', coalesce(library_book.description, '')), 'D')
+    """)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS library_book_title_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS library_book_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_book_upsert_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,48 @@
+from django.db import migrations, models
+import numpy as np
+
+
+def pack_vectors(apps, schema_editor):
+    """Convert the JSON ``{'indices', 'values'}`` vectors to int32 indices followed by float32 values."""
+    Book = apps.get_model('library', 'Book')
+    books = Book.objects.exclude(tfidf_vector__isnull=True).only('id', 'tfidf_vector').order_by('id')
+    batch = []
+    for book in books.iterator(chunk_size=2000):
+        # A JSON null, unlike SQL NULL, passes the isnull filter; it stays NULL too
+        if book.tfidf_vector is None:
+            continue
+        vector = book.tfidf_vector or {'indices': [], 'values': []}
+        book.tfidf_packed = (
+            np.asarray(vector['indices'], dtype='<i4').tobytes()
+            + np.asarray(vector['values'], dtype='<f4').tobytes()
+        )
+        batch.append(book)
+        if len(batch) >= 2000:
+            Book.objects.bulk_update(batch, ['tfidf_packed'])
+            batch = []
+    Book.objects.bulk_update(batch, ['tfidf_packed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='tfidf_packed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_vectors, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='book',
+            name='tfidf_vector',
+        ),
+        migrations.RenameField(
+            model_name='book',
+            old_name='tfidf_packed',
+            new_name='tfidf_vector',
+        ),
+    ]
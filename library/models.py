@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import connection, models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import SearchVectorField
 class User(AbstractUser):
     # Additional fields can be added here if needed
     pass
@@ -20,6 +22,7 @@ class Author(models.Model):
     first_name = models.CharField(max_length=100, db_index=True)
     last_name = models.CharField(max_length=100, db_index=True)
     date_of_birth = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         indexes = [
@@ -43,13 +46,35 @@ class Book(models.Model):
     description = models.TextField(blank=True)
     image_url = models.URLField(max_length=500, blank=True, null=True)
     authors = models.ManyToManyField(Author)
-    tfidf_vector = models.JSONField(null=True, blank=True)
+    # Packed sparse TF-IDF row, see library.similarity.pack_vector
+    tfidf_vector = models.BinaryField(null=True, blank=True)
+    # Set when the book's neighbour list must be recomputed by compute_similarities --incremental
+    similarity_dirty = models.BooleanField(default=True, db_index=True)
+    # Hash of the imported record, used by import_books --upsert to skip unchanged books
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+    # Weighted title, author, shelf and description lexemes, kept current by library.search.update_search_vectors
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Bumped on every API or import write; drives Last-Modified on catalog reads
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['title']),
             models.Index(fields=['isbn']),
         ]
+        constraints = [
+            # Upsert keys: isbn13 when present, otherwise isbn
+            models.UniqueConstraint(
+                fields=['isbn13'],
+                condition=models.Q(isbn13__gt=''),
+                name='unique_book_isbn13',
+            ),
+            models.UniqueConstraint(
+                fields=['isbn'],
+                condition=models.Q(isbn__gt='') & (models.Q(isbn13__isnull=True) | models.Q(isbn13='')),
+                name='unique_book_isbn_without_isbn13',
+            ),
+        ]
 
     def __str__(self):
         return self.title
@@ -67,15 +92,83 @@ class Favorite(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.book.title}"
 
+# Key of the PostgreSQL advisory lock serializing similarity generation swaps
+GENERATION_LOCK_KEY = 0x6C6962726172
+
+
+class SimilarityGeneration(models.Model):
+    """
+    One full set of BookSimilarity rows.
+
+    Rebuilds write into a new inactive generation and switch it active in a
+    single transaction, so readers never see a partially built table.
+    """
+    created_on = models.DateTimeField(auto_now_add=True)
+    completed_on = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['is_active'],
+                condition=models.Q(is_active=True),
+                name='unique_active_similarity_generation',
+            ),
+        ]
+
+    @staticmethod
+    def lock():
+        """
+        Serialize generation swaps until the end of the current transaction.
+        SQLite already runs one writing transaction at a time.
+        """
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [GENERATION_LOCK_KEY])
+
+    @transaction.atomic
+    def activate(self):
+        """
+        Make this generation the one readers see, retiring the previous one in
+        the same transaction. Returns the retired generation, if any; the swap
+        lock is held until the outermost transaction ends.
+        """
+        self.lock()
+        previous = SimilarityGeneration.objects.filter(is_active=True).exclude(pk=self.pk).first()
+        if previous is not None:
+            previous.is_active = False
+            previous.save(update_fields=['is_active'])
+        self.is_active = True
+        self.completed_on = timezone.now()
+        self.save(update_fields=['is_active', 'completed_on'])
+        return previous
+
+    def discard(self):
+        # Similarities have no dependants, so this is a single DELETE statement
+        BookSimilarity.objects.filter(generation=self).delete()
+        self.delete()
+
+    def __str__(self):
+        return f"Similarity generation {self.pk}{' (active)' if self.is_active else ''}"
+
+
+class BookSimilarityQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(generation__is_active=True)
+
+
 class BookSimilarity(models.Model):
+    generation = models.ForeignKey(SimilarityGeneration, on_delete=models.CASCADE, related_name='similarities')
     book1 = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='similarities_from')
     book2 = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='similarities_to')
     similarity = models.FloatField()
 
+    objects = BookSimilarityQuerySet.as_manager()
+
     class Meta:
-        unique_together = ('book1', 'book2')
+        unique_together = ('generation', 'book1', 'book2')
         indexes = [
-            models.Index(fields=['book1', 'similarity']),
+            models.Index(fields=['generation', 'book1', 'similarity']),
             models.Index(fields=['book2', 'similarity']),
         ]
 
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .snapshot import Snapshot, SnapshotLoader, SnapshotLock, write_snapshot
+
+MAGIC = b'LIBNBRS1'
+
+
+def snapshot_path():
+    return os.path.join(settings.SIMILARITY_INDEX_DIR, 'neighbours.snap')
+
+
+class NeighbourTable(Snapshot):
+    """
+    Each book's neighbour list, best first, in CSR layout: ``book_ids`` (sorted
+    int32), ``offsets`` into the contiguous int32 ``neighbour_ids`` and
+    float32 ``scores``.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, MAGIC)
+        self.book_ids = self.arrays['book_ids']
+        self.offsets = self.arrays['offsets']
+        self.neighbour_ids = self.arrays['neighbour_ids']
+        self.scores = self.arrays['scores']
+
+    def neighbours(self, book_id, limit=None):
+        """``(neighbour_ids, scores)`` of ``book_id``, or None when it has no stored list."""
+        row = int(np.searchsorted(self.book_ids, book_id))
+        if row == len(self.book_ids) or self.book_ids[row] != book_id:
+            return None
+        start, end = self.offsets[row], self.offsets[row + 1]
+        if limit is not None:
+            end = min(end, start + limit)
+        return self.neighbour_ids[start:end], self.scores[start:end]
+
+
+_loader = SnapshotLoader(NeighbourTable)
+
+
+def get_table(path=None):
+    """The current neighbour table for this process, or None before compute_similarities has written one."""
+    return _loader.get(path or snapshot_path())
+
+
+class NeighbourTableWriter:
+    """
+    Collects neighbour lists in book id order, as ``compute_similarities``
+    produces them, and writes them as one snapshot.
+    """
+
+    def __init__(self):
+        self.book_ids = []
+        self.counts = []
+        self.neighbour_ids = []
+        self.scores = []
+
+    def add_rows(self, book_ids, neighbour_ids, scores):
+        """Append a block of lists; ``neighbour_ids[i]`` and ``scores[i]`` belong to ``book_ids[i]``."""
+        if not len(book_ids):
+            return
+        self.book_ids.append(np.asarray(book_ids, dtype=np.int32))
+        self.counts.append(np.fromiter(map(len, neighbour_ids), dtype=np.int64, count=len(neighbour_ids)))
+        self.neighbour_ids.append(np.concatenate([np.empty(0, dtype=np.int32), *neighbour_ids]).astype(np.int32))
+        self.scores.append(np.concatenate([np.empty(0, dtype=np.float32), *scores]).astype(np.float32))
+
+    def arrays(self):
+        def joined(arrays, dtype):
+            return np.concatenate([np.empty(0, dtype=dtype), *arrays]).astype(dtype)
+
+        return {
+            'book_ids': joined(self.book_ids, np.int32),
+            'offsets': np.concatenate([[0], np.cumsum(joined(self.counts, np.int64))]).astype(np.int64),
+            'neighbour_ids': joined(self.neighbour_ids, np.int32),
+            'scores': joined(self.scores, np.float32),
+        }
+
+    def write(self, path=None):
+        path = path or snapshot_path()
+        with SnapshotLock(path):
+            write_snapshot(path, self.arrays(), MAGIC)
+
+
+def remove_table(path=None):
+    """Delete the snapshot; ``get_table`` returns None until compute_similarities writes a new one."""
+    path = path or snapshot_path()
+    with SnapshotLock(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def replace_rows(updates, path=None):
+    """
+    Replace the neighbour lists of the books in ``updates`` (``book_id ->
+    (neighbour_ids, scores)``) and rewrite the snapshot. Unchanged runs of
+    rows are copied as whole slices. Does nothing until a snapshot exists.
+    """
+    path = path or snapshot_path()
+    if not os.path.exists(path):
+        return
+    with SnapshotLock(path):
+        table = NeighbourTable(path)
+        old_ids, old_offsets = table.book_ids, table.offsets
+        book_ids, counts, neighbour_ids, scores = [], [], [], []
+
+        def copy_rows(start, end):
+            book_ids.append(old_ids[start:end])
+            counts.append(np.diff(old_offsets[start:end + 1]))
+            neighbour_ids.append(table.neighbour_ids[old_offsets[start]:old_offsets[end]])
+            scores.append(table.scores[old_offsets[start]:old_offsets[end]])
+
+        position = 0
+        for book_id in sorted(updates):
+            row = int(np.searchsorted(old_ids, book_id))
+            copy_rows(position, row)
+            ids, row_scores = updates[book_id]
+            book_ids.append(np.array([book_id], dtype=np.int32))
+            counts.append(np.array([len(ids)], dtype=np.int64))
+            neighbour_ids.append(np.asarray(ids, dtype=np.int32))
+            scores.append(np.asarray(row_scores, dtype=np.float32))
+            position = row + 1 if row < len(old_ids) and old_ids[row] == book_id else row
+        copy_rows(position, len(old_ids))
+
+        write_snapshot(path, {
+            'book_ids': np.concatenate(book_ids).astype(np.int32),
+            'offsets': np.concatenate([[0], np.cumsum(np.concatenate(counts), dtype=np.int64)]).astype(np.int64),
+            'neighbour_ids': np.concatenate(neighbour_ids).astype(np.int32),
+            'scores': np.concatenate(scores).astype(np.float32),
+        }, MAGIC)
@@ -1,6 +1,70 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class KeysetResultsSetPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key: each page is ``WHERE id > ...
+    LIMIT n`` with no COUNT, so deep pages cost the same as the first.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+
 
 class StandardResultsSetPagination(PageNumberPagination):
+    """
+    Page-number pagination by default. ``?pagination=cursor`` (or following a
+    ``next`` link that carries a ``cursor``) switches to keyset pagination.
+    """
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 100
+    keyset_pagination_class = KeysetResultsSetPagination
+    keyset = None
+
+    def use_keyset(self, request):
+        return (
+            self.keyset_pagination_class.cursor_query_param in request.query_params
+            or request.query_params.get('pagination') == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.keyset is not None:
+            return self.keyset.get_html_context()
+        return super().get_html_context()
+
+    def to_html(self):
+        if self.keyset is not None:
+            return self.keyset.to_html()
+        return super().to_html()
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': 'pagination',
+            'required': False,
+            'in': 'query',
+            'description': 'Set to "cursor" for keyset pagination.',
+            'schema': {'type': 'string', 'enum': ['cursor']},
+        })
+        parameters.append({
+            'name': self.keyset_pagination_class.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': self.keyset_pagination_class.cursor_query_description,
+            'schema': {'type': 'string'},
+        })
+        return parameters
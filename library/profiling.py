@@ -0,0 +1,297 @@
+import contextvars
+import cProfile
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Request-Profile'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Placeholder lists of any length share a signature, so batched IN queries count as one statement
+_PLACEHOLDER_LIST = re.compile(r'%s(?:, %s)+')
+
+_current = contextvars.ContextVar('request_profile', default=None)
+
+# Application counters kept by the registry, with their help text
+COUNTERS = {
+    'library_recommendation_cache_requests_total': 'Recommendation cache lookups, by result.',
+}
+
+
+class RequestProfile:
+    """Database and serializer time of one profiled request."""
+
+    def __init__(self):
+        self.view = None
+        self.db_time = 0.0
+        self.statements = Counter()
+        self.serializer_time = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook timing every query."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.statements[_PLACEHOLDER_LIST.sub('%s, ...', sql)] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.statements.values())
+
+    @property
+    def duplicate_count(self):
+        """Queries repeating a statement already run by this request."""
+        return sum(count - 1 for count in self.statements.values())
+
+    def repeated(self, threshold):
+        """Statements run at least ``threshold`` times: the N+1 signatures."""
+        return {sql: count for sql, count in self.statements.items() if count >= threshold}
+
+
+@contextmanager
+def profiled(serializer):
+    """Adds the time spent in the block to ``serializer``'s time in the current request profile, if any."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.serializer_time[serializer] += time.perf_counter() - started
+
+
+class ProfiledRepresentationMixin:
+    """Adds the serializer's ``to_representation`` time to the current request profile, if any."""
+
+    def to_representation(self, instance):
+        with profiled(type(self).__name__):
+            return super().to_representation(instance)
+
+
+class ViewStats:
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.duration = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.duplicates = 0
+        self.serializer_time = Counter()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """
+    Cumulative per-view aggregates of profiled requests and the application
+    ``COUNTERS``, rendered in the Prometheus text format; rolling rates and
+    quantiles come from PromQL (``rate()``, ``histogram_quantile()``).
+
+    Everything is kept in the memory of one process, and a scrape sees only
+    the process answering it. The numbers are only meaningful when a single
+    process serves the API (gunicorn ``--workers 1``, scaled with
+    ``--threads``). With several workers each scrape reaches a random one,
+    so ``rate()`` sees counter resets and ratios mix workers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.counters = Counter()
+
+    def increment(self, name, **labels):
+        """Add one to the counter ``name`` (one of ``COUNTERS``) with these labels."""
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += 1
+
+    def count(self, name, **labels):
+        with self.lock:
+            return self.counters[name, tuple(sorted(labels.items()))]
+
+    def observe(self, view, duration, profile):
+        with self.lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = ViewStats()
+            stats.count += 1
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+            stats.duration += duration
+            stats.db_time += profile.db_time
+            stats.queries += profile.query_count
+            stats.duplicates += profile.duplicate_count
+            stats.serializer_time.update(profile.serializer_time)
+
+    def render(self):
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = [
+                '# HELP library_request_duration_seconds Wall time of profiled requests.',
+                '# TYPE library_request_duration_seconds histogram',
+            ]
+            for view, stats in views:
+                view = _label(view)
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    lines.append(f'library_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+                lines.append(f'library_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {stats.count}')
+                lines.append(f'library_request_duration_seconds_sum{{view="{view}"}} {stats.duration}')
+                lines.append(f'library_request_duration_seconds_count{{view="{view}"}} {stats.count}')
+            for name, attribute, help_text in (
+                ('library_request_db_seconds_total', 'db_time', 'Time spent in database queries.'),
+                ('library_request_queries_total', 'queries', 'Database queries run.'),
+                ('library_request_duplicate_queries_total', 'duplicates', 'Queries repeating an earlier statement.'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for view, stats in views:
+                    lines.append(f'{name}{{view="{_label(view)}"}} {getattr(stats, attribute)}')
+            lines.append('# HELP library_serializer_seconds_total Time spent serializing, by serializer.')
+            lines.append('# TYPE library_serializer_seconds_total counter')
+            for view, stats in views:
+                for serializer, seconds in sorted(stats.serializer_time.items()):
+                    lines.append(
+                        f'library_serializer_seconds_total{{view="{_label(view)}",serializer="{serializer}"}} {seconds}'
+                    )
+            counters = sorted(self.counters.items())
+            for name, help_text in COUNTERS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for (counter, labels), value in counters:
+                    if counter == name:
+                        label_text = ','.join(f'{key}="{_label(label)}"' for key, label in labels)
+                        lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def view_name(request, view_func):
+    """``BookViewSet.list``-style name of the view (and viewset action) handling ``request``."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    action = getattr(view_func, 'actions', {}).get(request.method.lower())
+    return f'{cls.__name__}.{action}' if action else cls.__name__
+
+
+class Tracer:
+    """cProfile, or pyinstrument when REQUEST_PROFILING_TRACER asks for it, around one request."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        if kind == 'pyinstrument':
+            from pyinstrument import Profiler
+
+            self.profiler = Profiler()
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        if self.kind == 'pyinstrument':
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+
+    def save(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        if self.kind == 'pyinstrument':
+            path += '.html'
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.profiler.output_html())
+        else:
+            path += '.prof'
+            self.profiler.dump_stats(path)
+        return path
+
+
+class RequestProfilingMiddleware:
+    """
+    Opt-in per-request profiling: wall, database and serializer time, query
+    counts and repeated statements, aggregated per view for ``/metrics/``.
+
+    Every request is profiled with REQUEST_PROFILING; otherwise only those
+    sending REQUEST_PROFILING_TOKEN in the ``X-Request-Profile`` header. With
+    neither configured the middleware removes itself at startup. Profiled
+    responses carry a ``Server-Timing`` header, and requests slower than
+    REQUEST_PROFILING_SLOW_MS leave a trace in REQUEST_PROFILING_TRACE_DIR.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING and not settings.REQUEST_PROFILING_TOKEN:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.always = settings.REQUEST_PROFILING
+        self.token = settings.REQUEST_PROFILING_TOKEN
+        self.slow = settings.REQUEST_PROFILING_SLOW_MS / 1000
+        self.trace_dir = settings.REQUEST_PROFILING_TRACE_DIR
+        self.tracer = settings.REQUEST_PROFILING_TRACER
+        self.duplicate_threshold = settings.REQUEST_PROFILING_DUPLICATE_THRESHOLD
+
+    def profiling(self, request):
+        if self.always:
+            return True
+        header = request.headers.get(HEADER)
+        return header is not None and hmac.compare_digest(header, self.token)
+
+    def __call__(self, request):
+        if not self.profiling(request):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        context_token = _current.set(profile)
+        tracer = Tracer(self.tracer) if self.trace_dir else None
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(profile.execute))
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - started
+            if tracer is not None:
+                tracer.stop()
+            _current.reset(context_token)
+
+        view = profile.view or 'unresolved'
+        registry.observe(view, duration, profile)
+        for sql, count in profile.repeated(self.duplicate_threshold).items():
+            logger.warning('%s %s ran the same statement %d times: %s', request.method, view, count, sql)
+        if tracer is not None and duration >= self.slow:
+            path = tracer.save(self.trace_dir, f'{time.strftime("%Y%m%dT%H%M%S")}-{view}-{duration * 1000:.0f}ms')
+            logger.info('Saved trace of %s %s (%.0f ms) to %s', request.method, request.path, duration * 1000, path)
+
+        timings = [
+            f'total;dur={duration * 1000:.1f}',
+            f'db;dur={profile.db_time * 1000:.1f};desc="{profile.query_count} queries"',
+        ]
+        timings += [
+            f'{serializer};dur={seconds * 1000:.1f}' for serializer, seconds in profile.serializer_time.items()
+        ]
+        response['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _current.get()
+        if profile is not None:
+            profile.view = view_name(request, view_func)
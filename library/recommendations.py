@@ -0,0 +1,132 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+from .models import BookSimilarity, Favorite
+from .profiling import registry
+from .recommender import get_recommender
+from .serializers import represent_books
+
+# Number of books recommended to a user
+RECOMMENDATION_COUNT = 5
+
+# Bumped after every similarity rebuild; entries stored under an older version are stale
+VERSION_KEY = 'recommendations:version'
+
+# Hits and misses of get_recommendations, scraped from /metrics/
+CACHE_COUNTER = 'library_recommendation_cache_requests_total'
+
+def _user_key(user_id):
+    return f'recommendations:user:{user_id}'
+
+
+def _sql_recommendations(favorite_books, count):
+    """``(book_id, score)`` pairs summed in SQL, for when no neighbour table has been written."""
+    similar_books = BookSimilarity.objects.active().filter(
+        book1_id__in=favorite_books
+    ).exclude(
+        book2_id__in=favorite_books
+    ).values(
+        'book2_id'
+    ).annotate(
+        total_similarity=Sum('similarity')
+    ).order_by('-total_similarity', 'book2_id')[:count]
+    return [(item['book2_id'], item['total_similarity']) for item in similar_books]
+
+
+def rank_recommendations(favorite_books, count=RECOMMENDATION_COUNT):
+    """The ``count`` best ``(book_id, score)`` pairs for a set of favorite books, best first."""
+    recommender = get_recommender()
+    if recommender is None:
+        return _sql_recommendations(favorite_books, count)
+    return recommender.recommend(favorite_books, count)
+
+
+def compute_recommendations(user_id):
+    favorite_books = Favorite.objects.filter(user_id=user_id).values_list('book', flat=True)
+    favorite_books = list(favorite_books)
+
+    if not favorite_books:
+        return []
+
+    # Represent the books in ranking order
+    return represent_books(book_id for book_id, _ in rank_recommendations(favorite_books))
+
+
+def recommend_for_users(user_ids, count=RECOMMENDATION_COUNT):
+    """
+    Ranked ``(book_id, score)`` recommendations for many users, e.g. for
+    digest emails. Favorites are read in one query and, with a neighbour
+    table, every user is scored in a single sparse matrix product.
+    """
+    favorites_by_user = {user_id: [] for user_id in user_ids}
+    for user_id, book_id in Favorite.objects.filter(user_id__in=favorites_by_user).values_list('user_id', 'book_id'):
+        favorites_by_user[user_id].append(book_id)
+
+    recommender = get_recommender()
+    if recommender is None:
+        return {
+            user_id: _sql_recommendations(favorites, count) if favorites else []
+            for user_id, favorites in favorites_by_user.items()
+        }
+    return recommender.recommend_many(favorites_by_user, count)
+
+
+def _current_version(version):
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def refresh_recommendations(user_id):
+    """Recompute a user's recommendations and store them in the cache."""
+    version = _current_version(cache.get(VERSION_KEY))
+    data = list(compute_recommendations(user_id))
+    cache.set(
+        _user_key(user_id),
+        {'version': version, 'data': data},
+        timeout=settings.RECOMMENDATION_CACHE_TIMEOUT,
+    )
+    return data
+
+
+def cached_recommendations(user_id):
+    """Return the user's cached recommendations if they are fresh, otherwise None. Never computes."""
+    key = _user_key(user_id)
+    cached = cache.get_many([key, VERSION_KEY])
+    entry = cached.get(key)
+    if entry is not None and entry['version'] == cached.get(VERSION_KEY):
+        return entry['data']
+    return None
+
+
+def invalidate_recommendations(user_id):
+    cache.delete(_user_key(user_id))
+
+
+def get_recommendations(user):
+    """
+    Cached recommendations for ``user``.
+
+    A hit costs one cache round trip and no SQL; a miss or an entry from
+    before the last similarity rebuild recomputes and stores them.
+    """
+    key = _user_key(user.pk)
+    cached = cache.get_many([key, VERSION_KEY])
+    entry = cached.get(key)
+    if entry is not None and entry['version'] == _current_version(cached.get(VERSION_KEY)):
+        registry.increment(CACHE_COUNTER, result='hit')
+        return entry['data']
+    registry.increment(CACHE_COUNTER, result='miss')
+    return refresh_recommendations(user.pk)
+
+
+def invalidate_all_recommendations():
+    """Mark every cached recommendation stale, e.g. after a similarity rebuild."""
+    cache.add(VERSION_KEY, 1, timeout=None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # The key was evicted between add and incr
+        cache.set(VERSION_KEY, 2, timeout=None)
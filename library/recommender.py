@@ -0,0 +1,93 @@
+import numpy as np
+from scipy import sparse
+
+from .neighbours import get_table
+
+
+class Recommender:
+    """
+    The neighbour table as a sparse book-by-book similarity matrix.
+
+    A user's scores are the sum of their favorites' rows: the same
+    ``Sum('similarity')`` the SQL query computes, done in memory.
+    """
+
+    def __init__(self, table):
+        self.book_ids = table.book_ids
+        n_books = len(self.book_ids)
+        columns = np.searchsorted(self.book_ids, table.neighbour_ids).astype(np.int32)
+        # A neighbour without a row of its own (possible after an incremental update) would land on a wrong column
+        known = columns < n_books
+        known[known] = self.book_ids[columns[known]] == table.neighbour_ids[known]
+        data = np.where(known, table.scores, 0).astype(np.float32)
+        self.matrix = sparse.csr_matrix(
+            (data, np.where(known, columns, 0), np.asarray(table.offsets)), shape=(n_books, n_books)
+        )
+        self.matrix.eliminate_zeros()
+
+    def rows(self, book_ids):
+        """Matrix rows of the books in ``book_ids`` that have a neighbour list."""
+        book_ids = np.asarray(list(book_ids), dtype=np.int64)
+        rows = np.searchsorted(self.book_ids, book_ids)
+        present = rows < len(self.book_ids)
+        present[present] = self.book_ids[rows[present]] == book_ids[present]
+        return rows[present]
+
+    def _top(self, columns, scores, count):
+        """``(book_id, score)`` of the ``count`` best columns, ties going to the lower book id."""
+        if len(columns) > count:
+            best = np.argpartition(-scores, count - 1)[:count]
+            columns, scores = columns[best], scores[best]
+        book_ids = self.book_ids[columns]
+        order = np.lexsort((book_ids, -scores))
+        return [(int(book_ids[i]), float(scores[i])) for i in order]
+
+    def recommend(self, favorite_ids, count):
+        """The ``count`` best ``(book_id, score)`` pairs for a user with these favorites."""
+        favorites = self.rows(favorite_ids)
+        if not len(favorites):
+            return []
+        block = self.matrix[favorites]
+        columns, inverse = np.unique(block.indices, return_inverse=True)
+        scores = np.bincount(inverse, weights=block.data)
+        keep = ~np.isin(columns, favorites)
+        return self._top(columns[keep], scores[keep], count)
+
+    def recommend_many(self, favorites_by_user, count):
+        """
+        ``recommend`` for many users at once: one sparse users-by-books
+        favorites matrix times the similarity matrix. Returns a dict of user
+        id to ``(book_id, score)`` pairs.
+        """
+        user_ids = list(favorites_by_user)
+        favorite_rows = [self.rows(favorites_by_user[user_id]) for user_id in user_ids]
+        indptr = np.concatenate([[0], np.cumsum([len(rows) for rows in favorite_rows])]).astype(np.int64)
+        indices = np.concatenate([np.empty(0, dtype=np.int64), *favorite_rows])
+        favorites = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(user_ids), len(self.book_ids)),
+        )
+        scores = (favorites @ self.matrix).tocsr()
+        # Drop each user's own favorites
+        scores = (scores - scores.multiply(favorites)).tocsr()
+        scores.eliminate_zeros()
+
+        results = {}
+        for row, user_id in enumerate(user_ids):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            results[user_id] = self._top(scores.indices[start:end], scores.data[start:end], count)
+        return results
+
+
+_loaded = None
+
+
+def get_recommender():
+    """A Recommender over the current neighbour table, built once per table and process; None without one."""
+    global _loaded
+    table = get_table()
+    if table is None:
+        return None
+    if _loaded is None or _loaded[0] is not table:
+        _loaded = (table, Recommender(table))
+    return _loaded[1]
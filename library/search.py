@@ -0,0 +1,137 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Q, Value, When
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+from .models import Author, Book, Shelf
+
+# Text search configuration used for the search_vector column and queries
+SEARCH_CONFIG = 'english'
+
+# Books whose search vectors are rebuilt per UPDATE statement
+UPDATE_BATCH_SIZE = 5000
+
+# title and author names weigh most, then shelves, then the description
+_UPDATE_SQL = """
+    UPDATE {book} SET search_vector =
+        setweight(to_tsvector(%(config)s, coalesce({book}.title, '')), 'A')
+        || setweight(to_tsvector(%(config)s, coalesce((
+            SELECT string_agg({author}.first_name || ' ' || {author}.last_name, ' ')
+            FROM {book_authors} JOIN {author} ON {author}.id = {book_authors}.author_id
+            WHERE {book_authors}.book_id = {book}.id
+        ), '')), 'B')
+        || setweight(to_tsvector(%(config)s, coalesce((
+            SELECT string_agg({shelf}.name, ' ')
+            FROM {book_shelves} JOIN {shelf} ON {shelf}.id = {book_shelves}.shelf_id
+            WHERE {book_shelves}.book_id = {book}.id
+        ), '')), 'C')
+        || setweight(to_tsvector(%(config)s, coalesce({book}.description, '')), 'D')
+    WHERE {book}.id = ANY(%(ids)s)
+"""
+
+
+def _update_sql():
+    quote = connection.ops.quote_name
+    return _UPDATE_SQL.format(
+        book=quote(Book._meta.db_table),
+        author=quote(Author._meta.db_table),
+        shelf=quote(Shelf._meta.db_table),
+        book_authors=quote(Book.authors.through._meta.db_table),
+        book_shelves=quote(Book.shelves.through._meta.db_table),
+    )
+
+
+def update_search_vectors(book_ids):
+    """
+    Rebuild the search_vector of ``book_ids`` from their title, authors,
+    shelves and description. Call after writing a book or its relations.
+    A no-op on databases without PostgreSQL full-text search.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    book_ids = list(book_ids)
+    sql = _update_sql()
+    with connection.cursor() as cursor:
+        for start in range(0, len(book_ids), UPDATE_BATCH_SIZE):
+            cursor.execute(sql, {'config': SEARCH_CONFIG, 'ids': book_ids[start:start + UPDATE_BATCH_SIZE]})
+
+
+class PostgresSearchBackend:
+    """
+    Matches the GIN-indexed search_vector, or the title by trigram similarity
+    (``pg_trgm.similarity_threshold``) to tolerate typos, and orders by text rank plus title similarity.
+    """
+
+    def search(self, queryset, text):
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.annotate(
+            rank=SearchRank(F('search_vector'), query) + TrigramSimilarity('title', text),
+        ).filter(
+            Q(search_vector=query) | Q(title__trigram_similar=text)
+        ).order_by('-rank', 'id')
+
+
+class SimpleSearchBackend:
+    """
+    Portable fallback for SQLite and local testing: every term must appear in
+    the title, description, an author name or a shelf name. Titles rank above
+    authors, shelves and descriptions. Scans the table; not for production.
+    """
+
+    def search(self, queryset, text):
+        terms = text.split()
+        if not terms:
+            return queryset
+        rank = Value(0)
+        for term in terms:
+            in_author = Exists(Author.objects.filter(
+                Q(first_name__icontains=term) | Q(last_name__icontains=term), book=OuterRef('pk')
+            ))
+            in_shelf = Exists(Shelf.objects.filter(name__icontains=term, books=OuterRef('pk')))
+            queryset = queryset.filter(
+                Q(title__icontains=term) | Q(description__icontains=term) | in_author | in_shelf
+            )
+            rank = rank + Case(
+                When(title__icontains=term, then=Value(8)),
+                When(in_author, then=Value(4)),
+                When(in_shelf, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        return queryset.annotate(rank=rank).order_by('-rank', 'id')
+
+
+BACKENDS = {
+    'postgres': PostgresSearchBackend,
+    'simple': SimpleSearchBackend,
+}
+
+
+def get_backend(name=None):
+    """Backend named by ``BOOK_SEARCH_BACKEND``; ``auto`` picks by database vendor."""
+    name = name or settings.BOOK_SEARCH_BACKEND
+    if name == 'auto':
+        name = 'postgres' if connection.vendor == 'postgresql' else 'simple'
+    return BACKENDS[name]()
+
+
+class BookSearchFilter(BaseFilterBackend):
+    """``?search=`` over books, ranked by relevance, with one row per book."""
+    search_param = api_settings.SEARCH_PARAM
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '').replace('\x00', '').strip()
+        if not text:
+            return queryset
+        return get_backend().search(queryset, text)
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Full-text search over title, authors, shelves and description.',
+            'schema': {'type': 'string'},
+        }]
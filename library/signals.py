@@ -0,0 +1,34 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import invalidate_authors, invalidate_books, invalidate_catalog
+from .models import Author, Book
+
+# Bulk writes (bulk_create, bulk_update, QuerySet.update) send no signals;
+# callers such as import_books invalidate the catalog themselves.
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, instance, **kwargs):
+    invalidate_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def author_changed(sender, instance, **kwargs):
+    invalidate_authors([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.shelves.through)
+def book_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_books([instance.pk])
+    elif pk_set:
+        invalidate_books(pk_set)
+    else:
+        # post_clear from the author or shelf side no longer knows which books it touched
+        invalidate_catalog()
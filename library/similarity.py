@@ -0,0 +1,201 @@
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Number of neighbours kept per book
+MAX_SIMILARS = 50
+
+# Rows scored per block; peak memory is roughly block_size * n_books * 8 bytes
+DEFAULT_BLOCK_SIZE = 512
+
+
+def book_document(book):
+    """Build the text document describing a book's authors and shelves."""
+    authors = ' '.join([f'{author.first_name}_{author.last_name}' for author in book.authors.all()])
+    shelves = ' '.join([shelf.name.replace(' ', '_') for shelf in book.shelves.all()])
+    return f'{authors} {shelves}'
+
+
+def vectorize(documents):
+    vectorizer = TfidfVectorizer()
+    tfidf_matrix = vectorizer.fit_transform(documents)
+    return vectorizer, tfidf_matrix
+
+
+def save_vectorizer(vectorizer, path):
+    """Persist the fitted vocabulary and IDF weights so new books can be transformed without a refit."""
+    joblib.dump(vectorizer, path)
+
+
+def load_vectorizer(path):
+    return joblib.load(path)
+
+
+def pack_vector(row):
+    """
+    Pack one row of a CSR matrix for ``Book.tfidf_vector``: its little-endian
+    int32 column indices followed by as many float32 values.
+    """
+    return row.indices.astype('<i4').tobytes() + row.data.astype('<f4').tobytes()
+
+
+def matrix_from_packed(vectors, n_features):
+    """
+    Stack packed ``Book.tfidf_vector`` values into a float32 CSR matrix with
+    a handful of array operations rather than a decode per row. Missing
+    vectors become empty rows.
+    """
+    blobs = [vector or b'' for vector in vectors]
+    lengths = np.fromiter((len(blob) // 8 for blob in blobs), dtype=np.int64, count=len(blobs))
+    indptr = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    words = np.frombuffer(b''.join(blobs), dtype='<i4')
+
+    # Row r takes 2 * lengths[r] words starting at 2 * indptr[r]: its indices, then its values
+    row_of_entry = np.repeat(np.arange(len(blobs)), lengths)
+    positions = np.arange(indptr[-1]) + indptr[:-1][row_of_entry]
+    indices = words[positions].astype(np.int32)
+    data = words[positions + lengths[row_of_entry]].view('<f4').astype(np.float32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(blobs), n_features))
+
+
+def load_book_vectors(n_features, queryset=None):
+    """
+    Every stored book vector as ``(book_ids, matrix)``, rows ordered by book id.
+    ``queryset`` narrows the books loaded.
+    """
+    from .models import Book
+
+    queryset = Book.objects.all() if queryset is None else queryset
+    book_ids = []
+    vectors = []
+    for book_id, vector in queryset.order_by('id').values_list('id', 'tfidf_vector').iterator(chunk_size=10000):
+        book_ids.append(book_id)
+        vectors.append(vector)
+    return book_ids, matrix_from_packed(vectors, n_features)
+
+
+def top_k_block(scores, rows, k=MAX_SIMILARS):
+    """
+    Select the top ``k`` neighbours for each row of a dense block of scores.
+
+    ``scores[i]`` holds the similarities of catalog row ``rows[i]`` against the
+    whole catalog. Self matches and non-positive scores are dropped. Returns a
+    list of ``(indices, scores)`` pairs, best match first, ties broken by the
+    lower index.
+    """
+    n_rows, n_cols = scores.shape
+    # Never pick a book as its own neighbour
+    scores[np.arange(n_rows), rows] = -np.inf
+
+    k = min(k, n_cols)
+    if k <= 0:
+        return [(np.empty(0, dtype=np.intp), np.empty(0)) for _ in range(n_rows)]
+    if k < n_cols:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n_cols), (n_rows, 1))
+    candidates.sort(axis=1)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+    results = []
+    for indices, values in zip(candidates, candidate_scores):
+        keep = values > 0
+        results.append((indices[keep], values[keep]))
+    return results
+
+
+def score_rows(matrix, matrix_t, rows, k=MAX_SIMILARS):
+    """Exact top ``k`` neighbours for the given catalog rows."""
+    scores = (matrix[rows] @ matrix_t).toarray()
+    return top_k_block(scores, rows, k)
+
+
+def iter_top_k(tfidf_matrix, k=MAX_SIMILARS, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Yield ``(row_offset, results)`` for consecutive row blocks of ``tfidf_matrix``.
+
+    Rows are L2-normalised by ``TfidfVectorizer``, so the sparse product of a
+    row block with the transposed matrix is the cosine similarity. Only one
+    block of scores is materialised at a time.
+    """
+    tfidf_matrix = tfidf_matrix.tocsr()
+    matrix_t = tfidf_matrix.T.tocsr()
+    n_books = tfidf_matrix.shape[0]
+    for start in range(0, n_books, block_size):
+        end = min(start + block_size, n_books)
+        yield start, score_rows(tfidf_matrix, matrix_t, np.arange(start, end), k)
+
+
+# Blocks each pool worker may have queued or finished but not yet consumed
+IN_FLIGHT_PER_WORKER = 2
+
+# Matrices shared with pool workers, loaded once per process from memory-mapped files
+_worker_state = {}
+
+
+def _dump_csr(matrix, directory, name):
+    for part in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(directory, f'{name}.{part}.npy'), getattr(matrix, part))
+
+
+def _load_csr(directory, name, shape):
+    parts = [
+        np.load(os.path.join(directory, f'{name}.{part}.npy'), mmap_mode='r')
+        for part in ('data', 'indices', 'indptr')
+    ]
+    return sparse.csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+def _init_worker(directory, shape, k):
+    _worker_state['matrix'] = _load_csr(directory, 'matrix', shape)
+    _worker_state['matrix_t'] = _load_csr(directory, 'matrix_t', shape[::-1])
+    _worker_state['k'] = k
+
+
+def _score_block(bounds):
+    start, end = bounds
+    return start, score_rows(
+        _worker_state['matrix'], _worker_state['matrix_t'], np.arange(start, end), _worker_state['k']
+    )
+
+
+def iter_top_k_parallel(tfidf_matrix, workers, k=MAX_SIMILARS, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Same output as ``iter_top_k`` but with row blocks scored by a process pool.
+
+    The matrix is written once to memory-mapped ``.npy`` files that every
+    worker maps read-only, so tasks only carry row bounds and results.
+    Blocks are yielded in row order, with at most ``IN_FLIGHT_PER_WORKER``
+    blocks per worker submitted ahead of the consumer, so finished results
+    never pile up while it is busy writing them.
+    """
+    tfidf_matrix = tfidf_matrix.tocsr()
+    n_books = tfidf_matrix.shape[0]
+    bounds = ((start, min(start + block_size, n_books)) for start in range(0, n_books, block_size))
+    with tempfile.TemporaryDirectory(prefix='similarities-') as directory:
+        _dump_csr(tfidf_matrix, directory, 'matrix')
+        _dump_csr(tfidf_matrix.T.tocsr(), directory, 'matrix_t')
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(directory, tfidf_matrix.shape, k),
+        ) as executor:
+            pending = deque(
+                executor.submit(_score_block, block) for block in islice(bounds, workers * IN_FLIGHT_PER_WORKER)
+            )
+            while pending:
+                result = pending.popleft().result()
+                for block in islice(bounds, 1):
+                    pending.append(executor.submit(_score_block, block))
+                yield result
@@ -0,0 +1,182 @@
+import os
+
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+from .similarity import DEFAULT_BLOCK_SIZE, MAX_SIMILARS, iter_top_k, iter_top_k_parallel, score_rows
+
+# Dimensions of the reduced book vectors indexed by the ANN backends
+DEFAULT_DIMENSIONS = 128
+
+
+def reduce_dimensions(tfidf_matrix, dimensions=DEFAULT_DIMENSIONS, random_state=0):
+    """Project the TF-IDF matrix onto L2-normalised float32 vectors of at most ``dimensions`` columns."""
+    n_features = tfidf_matrix.shape[1]
+    if n_features <= dimensions:
+        vectors = tfidf_matrix.toarray()
+    else:
+        svd = TruncatedSVD(n_components=dimensions, random_state=random_state)
+        vectors = svd.fit_transform(tfidf_matrix)
+    return np.ascontiguousarray(normalize(vectors), dtype=np.float32)
+
+
+def rescore(tfidf_matrix, rows, candidates, k=MAX_SIMILARS):
+    """
+    Score ANN candidates exactly against the TF-IDF matrix.
+
+    ``candidates[i]`` lists catalog rows proposed for ``rows[i]``; negative
+    entries (padding) and self matches are ignored. Returns the same
+    ``(indices, scores)`` pairs as the exact engine.
+    """
+    results = []
+    for row, row_candidates in zip(rows, candidates):
+        row_candidates = np.unique(row_candidates[(row_candidates >= 0) & (row_candidates != row)])
+        scores = np.asarray((tfidf_matrix[row_candidates] @ tfidf_matrix[row].T).todense()).ravel()
+        order = np.argsort(-scores, kind='stable')[:k]
+        keep = scores[order] > 0
+        results.append((row_candidates[order][keep], scores[order][keep]))
+    return results
+
+
+class ExactBackend:
+    name = 'exact'
+
+    def __init__(self, k=MAX_SIMILARS, block_size=DEFAULT_BLOCK_SIZE, workers=1, **kwargs):
+        self.k = k
+        self.block_size = block_size
+        self.workers = workers
+        self.staged = []
+
+    def iter_top_k(self, tfidf_matrix):
+        if self.workers > 1:
+            return iter_top_k_parallel(tfidf_matrix, self.workers, k=self.k, block_size=self.block_size)
+        return iter_top_k(tfidf_matrix, k=self.k, block_size=self.block_size)
+
+
+class ANNBackend:
+    """
+    Base class for approximate backends.
+
+    Subclasses build an index over reduced book vectors, save it and return
+    raw candidate rows for a block of queries. The index and a ``.ids.npy``
+    file mapping index rows to book ids are staged as ``.new`` files next to
+    ``index_path``; ``staged`` lists ``(staged, live)`` path pairs for the
+    caller to move into place once the run is published.
+    """
+
+    name = None
+
+    def __init__(self, k=MAX_SIMILARS, block_size=DEFAULT_BLOCK_SIZE, dimensions=DEFAULT_DIMENSIONS,
+                 index_path=None, book_ids=None, **kwargs):
+        self.k = k
+        self.block_size = block_size
+        self.dimensions = dimensions
+        self.index_path = index_path
+        self.book_ids = book_ids
+        self.staged = []
+
+    def build(self, vectors):
+        raise NotImplementedError
+
+    def query(self, vectors, rows):
+        raise NotImplementedError
+
+    def save(self, path):
+        raise NotImplementedError
+
+    def stage(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        path = f'{self.index_path}.new'
+        self.staged.append((path, self.index_path))
+        self.save(path)
+        if self.book_ids is not None:
+            ids_path = f'{self.index_path}.ids.npy'
+            self.staged.append((f'{ids_path}.new', ids_path))
+            with open(f'{ids_path}.new', 'wb') as f:
+                np.save(f, np.asarray(self.book_ids, dtype=np.int64))
+
+    def iter_top_k(self, tfidf_matrix):
+        tfidf_matrix = tfidf_matrix.tocsr()
+        vectors = reduce_dimensions(tfidf_matrix, self.dimensions)
+        self.build(vectors)
+        if self.index_path:
+            self.stage()
+        n_books = tfidf_matrix.shape[0]
+        for start in range(0, n_books, self.block_size):
+            rows = np.arange(start, min(start + self.block_size, n_books))
+            yield start, rescore(tfidf_matrix, rows, self.query(vectors, rows), self.k)
+
+
+class FaissBackend(ANNBackend):
+    name = 'faiss'
+    hnsw_neighbors = 32
+    ef_construction = 80
+    ef_search = 128
+
+    def build(self, vectors):
+        import faiss
+
+        self.index = faiss.IndexHNSWFlat(vectors.shape[1], self.hnsw_neighbors, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = self.ef_construction
+        self.index.hnsw.efSearch = max(self.ef_search, self.k + 1)
+        self.index.add(vectors)
+
+    def query(self, vectors, rows):
+        _, candidates = self.index.search(vectors[rows], self.k + 1)
+        return candidates
+
+    def save(self, path):
+        import faiss
+
+        faiss.write_index(self.index, str(path))
+
+
+class AnnoyBackend(ANNBackend):
+    name = 'annoy'
+    n_trees = 50
+
+    def build(self, vectors):
+        from annoy import AnnoyIndex
+
+        self.index = AnnoyIndex(vectors.shape[1], 'angular')
+        for row, vector in enumerate(vectors):
+            self.index.add_item(row, vector)
+        self.index.build(self.n_trees)
+
+    def query(self, vectors, rows):
+        return [np.asarray(self.index.get_nns_by_item(int(row), self.k + 1), dtype=np.intp) for row in rows]
+
+    def save(self, path):
+        self.index.save(str(path))
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (ExactBackend, FaissBackend, AnnoyBackend)
+}
+
+
+def get_backend(name, **kwargs):
+    return BACKENDS[name](**kwargs)
+
+
+def sample_rows(n_books, sample_size=200, random_state=0):
+    rng = np.random.default_rng(random_state)
+    return np.sort(rng.choice(n_books, size=min(sample_size, n_books), replace=False))
+
+
+def recall_at_k(tfidf_matrix, approximate, k=MAX_SIMILARS):
+    """
+    Average recall@k of ``approximate`` (row -> neighbour rows) against the exact engine.
+
+    Rows without any exact neighbour are left out of the average.
+    """
+    tfidf_matrix = tfidf_matrix.tocsr()
+    rows = np.array(sorted(approximate), dtype=np.intp)
+    exact = score_rows(tfidf_matrix, tfidf_matrix.T.tocsr(), rows, k)
+    recalls = []
+    for row, (indices, _) in zip(rows, exact):
+        if len(indices):
+            recalls.append(len(set(indices) & set(approximate[row])) / len(indices))
+    return float(np.mean(recalls)) if recalls else 1.0
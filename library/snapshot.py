@@ -0,0 +1,109 @@
+import fcntl
+import json
+import mmap
+import os
+
+import numpy as np
+
+ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(path, arrays, magic):
+    """
+    Write a dict of 1-D numpy ``arrays`` to ``path`` atomically: an 8-byte
+    ``magic``, a JSON header and the raw arrays, aligned so readers can map
+    them in place.
+    """
+    header = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        header[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(magic) + 8 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(magic)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        # Empty trailing arrays still need their offset inside the file
+        f.truncate(data_start + max([spec['offset'] for spec in header.values()] + [offset]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """
+    Read-only arrays of a snapshot file, backed by a shared mmap so every
+    worker process maps the same pages instead of holding its own copy.
+    """
+
+    def __init__(self, path, magic):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(magic)] != magic:
+            raise ValueError(f'{path} is not a {magic.decode()} snapshot')
+        header_length = int.from_bytes(self._mmap[len(magic):len(magic) + 8], 'little')
+        header_end = len(magic) + 8 + header_length
+        header = json.loads(self._mmap[len(magic) + 8:header_end])
+        data_start = _aligned(header_end)
+        self.arrays = {
+            name: np.frombuffer(
+                self._mmap,
+                dtype=np.dtype(spec['dtype']),
+                count=int(np.prod(spec['shape'])),
+                offset=data_start + spec['offset'],
+            ).reshape(spec['shape'])
+            for name, spec in header.items()
+        }
+
+
+class SnapshotLoader:
+    """
+    Per-process cache of ``factory(path)``, re-created when a rebuild has
+    replaced the file. ``get`` returns None while no snapshot exists.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.loaded = {}
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        loaded = self.loaded.get(path)
+        if loaded is None or loaded.signature != signature:
+            loaded = self.loaded[path] = self.factory(path)
+        return loaded
+
+
+class SnapshotLock:
+    """Serializes read-modify-write rebuilds of a snapshot across processes."""
+
+    def __init__(self, path):
+        self.path = f'{path}.lock'
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
@@ -0,0 +1,266 @@
+import os
+import re
+import unicodedata
+
+import numpy as np
+from django.conf import settings
+
+from .models import Author, Book
+from .snapshot import Snapshot, SnapshotLoader, SnapshotLock, write_snapshot
+
+# Entry kinds
+TITLE = 0
+AUTHOR = 1
+KIND_NAMES = {TITLE: 'title', AUTHOR: 'author'}
+
+# Keys are UTF-8 tokens truncated to this many bytes; matches are verified against the full text
+KEY_BYTES = 24
+KEY_DTYPE = f'S{KEY_BYTES}'
+
+# Postings examined per query before filtering and de-duplication
+MAX_CANDIDATES = 500
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Rows fetched per query while building
+CHUNK_SIZE = 10000
+
+MAGIC = b'LIBSUGG1'
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lowercase and strip accents so 'Émile' completes from 'emi'."""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def _key(token):
+    return token.encode('utf-8')[:KEY_BYTES]
+
+
+def _iter_entries(book_ids=None, author_ids=None):
+    """Yield ``(kind, id, text)`` for books and authors, or only those listed."""
+    books = Book.objects.order_by('id')
+    authors = Author.objects.order_by('id')
+    if book_ids is not None:
+        books = books.filter(id__in=list(book_ids))
+    if author_ids is not None:
+        authors = authors.filter(id__in=list(author_ids))
+    for book_id, title in books.values_list('id', 'title').iterator(chunk_size=CHUNK_SIZE):
+        if title:
+            yield TITLE, book_id, title
+    for author_id, first_name, last_name in authors.values_list(
+        'id', 'first_name', 'last_name'
+    ).iterator(chunk_size=CHUNK_SIZE):
+        name = f'{first_name} {last_name}'.strip()
+        if name:
+            yield AUTHOR, author_id, name
+
+
+def _entry_arrays(entries, first_entry=0):
+    """Column arrays for ``entries`` plus their ``(key, entry)`` pairs."""
+    kinds, ids, lengths, texts, pair_keys, pair_entries = [], [], [], [], [], []
+    for offset, (kind, object_id, text) in enumerate(entries):
+        encoded = text.encode('utf-8')
+        kinds.append(kind)
+        ids.append(object_id)
+        lengths.append(len(encoded))
+        texts.append(encoded)
+        for key in sorted({_key(token) for token in tokenize(text)}):
+            pair_keys.append(key)
+            pair_entries.append(first_entry + offset)
+    return (
+        np.array(kinds, dtype=np.int8),
+        np.array(ids, dtype=np.int32),
+        np.array(lengths, dtype=np.int64),
+        np.frombuffer(b''.join(texts), dtype=np.uint8),
+        np.array(pair_keys, dtype=KEY_DTYPE),
+        np.array(pair_entries, dtype=np.int32),
+    )
+
+
+def _postings(pair_keys, pair_entries):
+    """Sorted unique keys and CSR postings; entries keep ascending order within a key."""
+    order = np.argsort(pair_keys, kind='stable')
+    sorted_keys = pair_keys[order]
+    keys, starts = np.unique(sorted_keys, return_index=True)
+    key_offsets = np.append(starts, len(sorted_keys)).astype(np.int64)
+    return keys.astype(KEY_DTYPE), key_offsets, pair_entries[order]
+
+
+def build_arrays(entries):
+    kinds, ids, lengths, text, pair_keys, pair_entries = _entry_arrays(entries)
+    keys, key_offsets, postings = _postings(pair_keys, pair_entries)
+    return {
+        'keys': keys,
+        'key_offsets': key_offsets,
+        'postings': postings,
+        'kinds': kinds,
+        'ids': ids,
+        'text_offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        'text': text,
+    }
+
+
+def delta_path(path):
+    return f'{path}.delta'
+
+
+class SuggestIndex(Snapshot):
+    """
+    One memory-mapped segment of the completion index; arrays are exposed as
+    attributes. Delta segments also list the books and authors whose entries
+    in the main segment they replace.
+    """
+
+    def __init__(self, path):
+        super().__init__(path, MAGIC)
+        for name, array in self.arrays.items():
+            setattr(self, name, array)
+        self.replaced = set()
+        if 'replaced_books' in self.arrays:
+            self.replaced.update((TITLE, book_id) for book_id in self.replaced_books.tolist())
+            self.replaced.update((AUTHOR, author_id) for author_id in self.replaced_authors.tolist())
+
+    def entry_text(self, entry):
+        return self.text[self.text_offsets[entry]:self.text_offsets[entry + 1]].tobytes().decode('utf-8')
+
+    def entries(self):
+        """Every ``(kind, id, text)`` in the segment."""
+        for entry, (kind, object_id) in enumerate(zip(self.kinds.tolist(), self.ids.tolist())):
+            yield kind, object_id, self.entry_text(entry)
+
+    def _prefix_range(self, token):
+        prefix = _key(token)
+        low = np.searchsorted(self.keys, np.array(prefix, dtype=KEY_DTYPE), side='left')
+        if len(prefix) < KEY_BYTES:
+            high = np.searchsorted(self.keys, np.array(prefix + b'\xff', dtype=KEY_DTYPE), side='left')
+        else:
+            high = np.searchsorted(self.keys, np.array(prefix, dtype=KEY_DTYPE), side='right')
+        return int(low), int(high)
+
+    def candidates(self, token):
+        """The first postings of keys starting with ``token``, as ``(key, entry)`` pairs in key order."""
+        low, high = self._prefix_range(token)
+        if low == high:
+            return []
+        # Short prefixes can match millions of postings; only look at the first few
+        start = int(self.key_offsets[low])
+        positions = np.arange(start, min(int(self.key_offsets[high]), start + 2 * MAX_CANDIDATES))
+        entries = self.postings[positions]
+        keys = self.keys[np.searchsorted(self.key_offsets, positions, side='right') - 1]
+        return list(zip(keys.tolist(), entries.tolist()))
+
+
+class Completions:
+    """The main segment with the entries of the delta segment, if any, merged in at query time."""
+
+    def __init__(self, main, delta=None):
+        self.segments = [main] if delta is None else [main, delta]
+        self.replaced = delta.replaced if delta is not None else set()
+
+    def suggest(self, query, limit=DEFAULT_LIMIT):
+        """
+        Titles and author names in which every query word starts a word.
+
+        Candidates come from the postings of the longest query word. Keys sort
+        lexicographically, so exact word matches come before longer completions.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        lookup = max(tokens, key=len)
+        candidates = sorted(
+            (
+                (key, number, entry)
+                for number, segment in enumerate(self.segments)
+                for key, entry in segment.candidates(lookup)
+            ),
+            key=lambda candidate: candidate[0],
+        )
+
+        results = []
+        seen = set()
+        for _, number, entry in candidates:
+            segment = self.segments[number]
+            kind = int(segment.kinds[entry])
+            object_id = int(segment.ids[entry])
+            if number == 0 and (kind, object_id) in self.replaced:
+                continue
+            text = segment.entry_text(entry)
+            words = tokenize(text)
+            if not all(any(word.startswith(token) for word in words) for token in tokens):
+                continue
+            duplicate = (kind, normalize(text))
+            if duplicate in seen:
+                continue
+            seen.add(duplicate)
+            results.append({'text': text, 'type': KIND_NAMES[kind], 'id': object_id})
+            if len(results) >= limit:
+                break
+        return results
+
+
+_loader = SnapshotLoader(SuggestIndex)
+
+
+def get_index(path=None):
+    """The current index for this process, or None when none has been built yet."""
+    path = path or settings.SUGGEST_INDEX_PATH
+    main = _loader.get(path)
+    if main is None:
+        return None
+    return Completions(main, _loader.get(delta_path(path)))
+
+
+def build_index(path=None):
+    """
+    Build the main segment from every book title and author name, dropping
+    the delta segment it supersedes. Returns the number of entries.
+    """
+    path = path or settings.SUGGEST_INDEX_PATH
+    with SnapshotLock(path):
+        arrays = build_arrays(list(_iter_entries()))
+        write_snapshot(path, arrays, MAGIC)
+        if os.path.exists(delta_path(path)):
+            os.remove(delta_path(path))
+    return len(arrays['kinds'])
+
+
+def update_index(book_ids=(), author_ids=(), path=None):
+    """
+    Refresh the entries of changed or deleted books and authors.
+
+    Only the delta segment is rewritten: the current rows of the changed
+    books and authors replace their entries in the main segment at query
+    time, so an edit costs the size of the delta, not of the index. Returns
+    whether the delta has outgrown SUGGEST_DELTA_MAX_ENTRIES and the index
+    should be rebuilt. Does nothing until a first index exists.
+    """
+    path = path or settings.SUGGEST_INDEX_PATH
+    changed = {(TITLE, book_id) for book_id in book_ids} | {(AUTHOR, author_id) for author_id in author_ids}
+    if not os.path.exists(path) or not changed:
+        return False
+    with SnapshotLock(path):
+        entries = []
+        replaced = set(changed)
+        if os.path.exists(delta_path(path)):
+            delta = SuggestIndex(delta_path(path))
+            entries = [entry for entry in delta.entries() if entry[:2] not in changed]
+            replaced |= delta.replaced
+        entries += _iter_entries(
+            [object_id for kind, object_id in changed if kind == TITLE],
+            [object_id for kind, object_id in changed if kind == AUTHOR],
+        )
+        arrays = build_arrays(entries)
+        arrays['replaced_books'] = np.array(sorted(i for kind, i in replaced if kind == TITLE), dtype=np.int64)
+        arrays['replaced_authors'] = np.array(sorted(i for kind, i in replaced if kind == AUTHOR), dtype=np.int64)
+        write_snapshot(delta_path(path), arrays, MAGIC)
+    return len(replaced) > settings.SUGGEST_DELTA_MAX_ENTRIES
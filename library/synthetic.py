@@ -0,0 +1,180 @@
+import json
+import multiprocessing
+import random
+
+import numpy as np
+
+# Pools are drawn with Zipf-like weights so some authors and shelves are far more common, as in real catalogs
+SYLLABLES = [
+    'ka', 'lo', 'mi', 'ra', 'ten', 'shi', 'vo', 'dan', 'el', 'mor', 'qui', 'zu', 'bel', 'tor', 'an', 'ish',
+    'go', 'pe', 'ul', 'ri', 'sa', 'wen', 'dor', 'fa', 'ny', 'cor', 'lin', 'ma', 'hal', 'ost',
+]
+LANGUAGES = ['eng', 'en-US', 'en-GB', 'spa', 'fre', 'ger']
+FORMATS = ['Paperback', 'Hardcover', 'Kindle Edition', 'ebook', 'Mass Market Paperback']
+# Records are generated this many at a time from one seeded numpy generator
+CHUNK_SIZE = 1000
+MAX_FAVORITES = 20
+
+
+def _word(rng, syllables=(1, 3)):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables)))
+
+
+def _unique(make, count):
+    values = dict.fromkeys(make() for _ in range(count))
+    while len(values) < count:
+        values[make()] = None
+    return list(values)
+
+
+def _zipf_cdf(size, exponent):
+    weights = np.cumsum(1 / np.arange(1, size + 1) ** exponent)
+    return weights / weights[-1]
+
+
+def _split(values, lengths):
+    """Cut a flat list into consecutive runs of ``lengths``."""
+    ends = np.cumsum(lengths).tolist()
+    return [values[end - length:end] for end, length in zip(ends, lengths.tolist())]
+
+
+def isbn13(index):
+    """The unique isbn13 of record ``index``."""
+    return f'978{index:010d}'
+
+
+def popular_rank(rng, size, count, exponent=3.0):
+    """
+    ``count`` ranks in ``[0, size)`` with power-law popularity: low ranks are
+    drawn far more often. Inverse-transform sampling, so no per-rank table.
+    """
+    return (size * rng.random(count) ** exponent).astype(np.int64)
+
+
+class CatalogGenerator:
+    """
+    Deterministic Goodreads-style book records in the format import_books
+    reads. Record ``i`` depends only on the seed, the pool sizes and ``i``, so
+    catalogs of different sizes share their common prefix.
+
+    Authors follow a Zipf distribution (a few prolific authors write many
+    books) and shelves a steeper power law. Records are built a chunk at a
+    time with numpy, so memory does not grow with the catalog size.
+    """
+
+    def __init__(self, seed=0, authors=5000, shelves=200, vocabulary=5000):
+        self.seed = seed
+        rng = random.Random(f'{seed}:pools')
+        self.authors = _unique(lambda: f'{_word(rng).title()} {_word(rng, (2, 4)).title()}', authors)
+        self.author_cdf = _zipf_cdf(len(self.authors), 0.8)
+        self.vocabulary = sorted(_unique(lambda: _word(rng), vocabulary))
+        self.shelves = sorted(_unique(lambda: '-'.join(_word(rng, (1, 2)) for _ in range(rng.randint(1, 3))), shelves))
+        self.shelf_cdf = _zipf_cdf(len(self.shelves), 1.1)
+
+    def _draw(self, rng, pool, cdf, low, high):
+        """Per record, ``low`` to ``high`` distinct weighted picks from ``pool``."""
+        lengths = rng.integers(low, high + 1, CHUNK_SIZE)
+        picks = np.minimum(np.searchsorted(cdf, rng.random(int(lengths.sum()))), len(pool) - 1).tolist()
+        return [[{'name': pool[i]} for i in dict.fromkeys(run)] for run in _split(picks, lengths)]
+
+    def _words(self, rng, low, high):
+        lengths = rng.integers(low, high + 1, CHUNK_SIZE)
+        vocabulary = self.vocabulary
+        words = [vocabulary[i] for i in rng.integers(0, len(vocabulary), int(lengths.sum())).tolist()]
+        return [' '.join(run) for run in _split(words, lengths)]
+
+    def _chunk(self, number):
+        rng = np.random.default_rng([self.seed, number])
+        first = number * CHUNK_SIZE
+        titles = self._words(rng, 1, 5)
+        authors = self._draw(rng, self.authors, self.author_cdf, 1, 3)
+        shelves = self._draw(rng, self.shelves, self.shelf_cdf, 3, 12)
+        descriptions = self._words(rng, 20, 80)
+        languages = rng.integers(0, len(LANGUAGES), CHUNK_SIZE).tolist()
+        formats = rng.integers(0, len(FORMATS), CHUNK_SIZE).tolist()
+        pages = rng.integers(40, 1201, CHUNK_SIZE).tolist()
+        ratings = rng.uniform(2.5, 5.0, CHUNK_SIZE).tolist()
+        publishers = rng.integers(0, len(self.vocabulary), CHUNK_SIZE).tolist()
+        dates = zip(*(rng.integers(low, high, CHUNK_SIZE).tolist() for low, high in ((1900, 2025), (1, 13), (1, 29))))
+        return [
+            {
+                'title': titles[i].title(),
+                'isbn': f'{first + i:010d}',
+                'isbn13': isbn13(first + i),
+                'authors': authors[i],
+                'shelves': shelves[i],
+                'description': descriptions[i].capitalize() + '.',
+                'language': LANGUAGES[languages[i]],
+                'format': FORMATS[formats[i]],
+                'num_pages': str(pages[i]),
+                'average_rating': f'{ratings[i]:.2f}',
+                'publisher': f'{self.vocabulary[publishers[i]].title()} Press',
+                'publication_date': f'{year}-{month:02d}-{day:02d}',
+                'image_url': f'https://images.example.com/books/{first + i}.jpg',
+            }
+            for i, (year, month, day) in enumerate(dates)
+        ]
+
+    def records(self, count, start=0):
+        """Yield records ``start`` to ``start + count - 1``."""
+        end = start + count
+        for number in range(start // CHUNK_SIZE, -(-end // CHUNK_SIZE)):
+            first = number * CHUNK_SIZE
+            yield from self._chunk(number)[max(start - first, 0):end - first]
+
+    def search_terms(self, count, seed_offset=0):
+        """Query strings drawn from the title vocabulary."""
+        rng = random.Random(f'{self.seed}:search:{seed_offset}')
+        return [' '.join(rng.choices(self.vocabulary, k=rng.randint(1, 2))) for _ in range(count)]
+
+    def favorites(self, users, books, start=0):
+        """
+        Yield ``(user_index, book_indexes)`` for users ``start`` onwards. Most
+        users keep a few favorites, a few hit the cap of ``MAX_FAVORITES``, and
+        books are picked with power-law popularity over their record index.
+        """
+        for number in range(start // CHUNK_SIZE, -(-(start + users) // CHUNK_SIZE)):
+            rng = np.random.default_rng([self.seed, number, 1])
+            counts = np.minimum(rng.geometric(0.2, CHUNK_SIZE), MAX_FAVORITES)
+            picks = popular_rank(rng, books, int(counts.sum())).tolist()
+            for offset, run in enumerate(_split(picks, counts)):
+                user = number * CHUNK_SIZE + offset
+                if start <= user < start + users:
+                    yield user, list(dict.fromkeys(run))
+
+
+_encode = json.JSONEncoder(check_circular=False).encode
+_worker_generator = None
+
+
+def _init_worker(seed, options):
+    global _worker_generator
+    _worker_generator = CatalogGenerator(seed, **options)
+
+
+def _encode_chunk(task):
+    number, skip, end = task
+    return ''.join(_encode(record) + '\n' for record in _worker_generator._chunk(number)[skip:end])
+
+
+def write_jsonl(path, count, seed=0, start=0, workers=1, **options):
+    """
+    Write ``count`` synthetic records to ``path`` as JSON Lines. With
+    ``workers`` > 1 chunks are generated in a process pool and written in
+    order, so the file is identical to a single-process run.
+    """
+    end = start + count
+    tasks = (
+        (number, max(start - number * CHUNK_SIZE, 0), end - number * CHUNK_SIZE)
+        for number in range(start // CHUNK_SIZE, -(-end // CHUNK_SIZE))
+    )
+    with open(path, 'w', encoding='utf-8') as f:
+        if workers > 1:
+            with multiprocessing.Pool(workers, _init_worker, (seed, options)) as pool:
+                for text in pool.imap(_encode_chunk, tasks, chunksize=4):
+                    f.write(text)
+        else:
+            _init_worker(seed, options)
+            for task in tasks:
+                f.write(_encode_chunk(task))
+    return path
@@ -0,0 +1,32 @@
+import logging
+
+from celery import shared_task
+from django.db import transaction
+
+from . import suggest
+from .recommendations import refresh_recommendations
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def refresh_user_recommendations(user_id):
+    refresh_recommendations(user_id)
+
+
+@shared_task(bind=True)
+def update_suggest_index(self, book_ids=(), author_ids=()):
+    if not suggest.update_index(book_ids, author_ids):
+        return
+    if self.request.is_eager:
+        # Eager tasks run in the web request; leave the rebuild to build_suggest_index
+        logger.warning('The suggest index delta is over SUGGEST_DELTA_MAX_ENTRIES; run build_suggest_index.')
+    else:
+        suggest.build_index()
+
+
+def schedule_suggest_index_update(book_ids=(), author_ids=()):
+    """Refresh the completion index for these rows once the current transaction commits."""
+    book_ids = list(book_ids)
+    author_ids = list(author_ids)
+    transaction.on_commit(lambda: update_suggest_index.delay(book_ids, author_ids))
@@ -1,11 +1,68 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from importlib.util import find_spec
+from io import StringIO
+from unittest import mock, skipUnless
+
+import numpy as np
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Book, Favorite
-from rest_framework.test import APIClient
+from django.core.cache import cache
+from django.core.management import CommandError, call_command, execute_from_command_line
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import JSONField, Value
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from .bulk import copy_rows
+from .importer import BookLoader, ImportCheckpoints, ParallelImport, iter_jsonl_range, load_array, shard_ranges
+from .management.commands.compute_similarities import vectorizer_path
+from .models import Author, Book, BookSimilarity, Favorite, Shelf, SimilarityGeneration
+from .profiling import registry
+from .recommendations import (
+    CACHE_COUNTER,
+    _sql_recommendations,
+    invalidate_all_recommendations,
+    rank_recommendations,
+    recommend_for_users,
+)
+from .renderers import FastJSONRenderer
+from .serializers import BookSerializer, represent_books
+from .similarity import iter_top_k, iter_top_k_parallel, load_book_vectors, pack_vector, vectorize
+from .similarity_backends import get_backend, recall_at_k, sample_rows
+from .suggest import build_index, delta_path
+from .synthetic import CatalogGenerator
 
 User = get_user_model()
 
+# Keeps tests that expect the SQL paths away from indexes built in the project data directory
+NO_INDEX_DIR = os.path.join(tempfile.gettempdir(), 'library-tests-no-index')
+
+
+class TemporaryIndexMixin:
+    """Points the suggest index and similarity snapshots at a fresh temporary directory for each test."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.index_dir = directory.name
+        settings_override = self.settings(
+            SIMILARITY_INDEX_DIR=directory.name, SUGGEST_INDEX_PATH=os.path.join(directory.name, 'suggest.idx')
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        super().setUp()
+
+
 class RecommendationTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -27,3 +84,752 @@ class RecommendationTests(TestCase):
         response = self.client.get('/api/recommendations/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(len(response.data) <= 5)
+
+class SimilarityEngineTests(TestCase):
+    def test_blocked_top_k_matches_dense_cosine(self):
+        documents = ['a_b fiction', 'a_b fantasy', 'c_d fiction', 'c_d history', 'e_f', 'a_b fiction']
+        _, tfidf_matrix = vectorize(documents)
+        dense = cosine_similarity(tfidf_matrix)
+
+        for start, results in iter_top_k(tfidf_matrix, k=3, block_size=4):
+            for offset, (indices, scores) in enumerate(results):
+                row = start + offset
+                self.assertNotIn(row, indices)
+                expected = sorted((s for i, s in enumerate(dense[row]) if i != row and s > 0), reverse=True)[:3]
+                np.testing.assert_allclose(scores, expected)
+
+    def test_parallel_top_k_matches_serial(self):
+        documents = [f'a_{i % 7} shelf_{i % 5} shelf_{i % 3}' for i in range(40)]
+        _, tfidf_matrix = vectorize(documents)
+        serial = list(iter_top_k(tfidf_matrix, k=5, block_size=4))
+        # Ten blocks, more than the two workers keep in flight, so later blocks are submitted as results are consumed
+        parallel = list(iter_top_k_parallel(tfidf_matrix, 2, k=5, block_size=4))
+
+        self.assertEqual([start for start, _ in serial], [start for start, _ in parallel])
+        for (_, expected), (_, actual) in zip(serial, parallel):
+            for (expected_indices, expected_scores), (indices, scores) in zip(expected, actual):
+                self.assertEqual(list(expected_indices), list(indices))
+                self.assertEqual(list(expected_scores), list(scores))
+
+
+    def test_packed_vectors_load_back_into_the_matrix(self):
+        _, tfidf_matrix = vectorize(['a_b fiction', 'c_d history fiction'])
+        books = [Book.objects.create(title=f'Book {i}') for i in range(3)]
+        for book, row in zip(books, tfidf_matrix):
+            book.tfidf_vector = pack_vector(row)
+            book.save()
+
+        book_ids, matrix = load_book_vectors(tfidf_matrix.shape[1])
+
+        self.assertEqual(book_ids, [book.id for book in books])
+        np.testing.assert_allclose(matrix[:2].toarray(), tfidf_matrix.toarray(), rtol=1e-6)
+        self.assertEqual(matrix[2].nnz, 0)
+
+
+class PackVectorsMigrationTests(TransactionTestCase):
+    migrate_from = ('library', '0012_updated_at')
+    migrate_to = ('library', '0013_book_tfidf_vector_packed')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        self.migrate(self.migrate_to)
+
+    def test_json_vectors_are_packed_and_missing_ones_stay_null(self):
+        old_book = self.migrate(self.migrate_from).get_model('library', 'Book')
+        packed = old_book.objects.create(title='Packed', tfidf_vector={'indices': [3, 7], 'values': [0.6, 0.8]})
+        empty = old_book.objects.create(title='Empty', tfidf_vector={'indices': [], 'values': []})
+        missing = old_book.objects.create(title='Missing', tfidf_vector=None)
+        json_null = old_book.objects.create(title='JSON null', tfidf_vector=Value(None, JSONField()))
+
+        new_book = self.migrate(self.migrate_to).get_model('library', 'Book')
+        vector = bytes(new_book.objects.get(id=packed.id).tfidf_vector)
+
+        self.assertEqual(vector, np.array([3, 7], '<i4').tobytes() + np.array([0.6, 0.8], '<f4').tobytes())
+        self.assertEqual(bytes(new_book.objects.get(id=empty.id).tfidf_vector), b'')
+        self.assertIsNone(new_book.objects.get(id=missing.id).tfidf_vector)
+        self.assertIsNone(new_book.objects.get(id=json_null.id).tfidf_vector)
+
+
+class SimilarityGenerationTests(TestCase):
+    def setUp(self):
+        self.book1 = Book.objects.create(title='Django for Beginners', isbn='1234567890123')
+        self.book2 = Book.objects.create(title='Advanced Django', isbn='1234567890124')
+
+    def test_only_active_generation_is_visible(self):
+        old = SimilarityGeneration.objects.create()
+        old.activate()
+        BookSimilarity.objects.create(generation=old, book1=self.book1, book2=self.book2, similarity=0.5)
+        staging = SimilarityGeneration.objects.create()
+        BookSimilarity.objects.create(generation=staging, book1=self.book1, book2=self.book2, similarity=0.9)
+
+        self.assertEqual(list(BookSimilarity.objects.active().values_list('similarity', flat=True)), [0.5])
+
+        staging.activate()
+        old.refresh_from_db()
+        self.assertFalse(old.is_active)
+        self.assertEqual(list(BookSimilarity.objects.active().values_list('similarity', flat=True)), [0.9])
+
+        old.discard()
+        self.assertEqual(BookSimilarity.objects.count(), 1)
+
+
+class ComputeSimilaritiesTests(TemporaryIndexMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        author = Author.objects.create(first_name='Jane', last_name='Doe')
+        shelf = Shelf.objects.create(name='fantasy')
+        for i in range(4):
+            book = Book.objects.create(title=f'Book {i}', isbn=str(i))
+            book.authors.add(author)
+            book.shelves.add(shelf)
+
+    def test_failed_scoring_leaves_books_dirty_and_vectorizer_unpublished(self):
+        with mock.patch(
+            'library.management.commands.compute_similarities.copy_rows', side_effect=RuntimeError('disk full')
+        ):
+            with self.assertRaises(RuntimeError):
+                call_command('compute_similarities', stdout=StringIO())
+
+        self.assertEqual(Book.objects.filter(similarity_dirty=False).count(), 0)
+        self.assertFalse(Book.objects.exclude(tfidf_vector__isnull=True).exists())
+        self.assertFalse(SimilarityGeneration.objects.exists())
+        self.assertEqual(os.listdir(self.index_dir), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('compute_similarities', stdout=StringIO())
+        self.assertFalse(Book.objects.filter(similarity_dirty=True).exists())
+        self.assertTrue(os.path.exists(vectorizer_path()))
+
+    def test_books_edited_during_a_run_stay_dirty(self):
+        edited = Book.objects.first()
+
+        def copy_rows_after_edit(*args, **kwargs):
+            edited.title = 'Edited while scoring'
+            edited.save()
+            return copy_rows(*args, **kwargs)
+
+        with mock.patch('library.management.commands.compute_similarities.copy_rows', copy_rows_after_edit):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('compute_similarities', stdout=StringIO())
+
+        edited.refresh_from_db()
+        self.assertTrue(edited.similarity_dirty)
+        self.assertIsNone(edited.tfidf_vector)
+        self.assertFalse(Book.objects.exclude(pk=edited.pk).filter(similarity_dirty=True).exists())
+        self.assertFalse(Book.objects.exclude(pk=edited.pk).filter(tfidf_vector__isnull=True).exists())
+
+    def test_publishing_keeps_generations_of_runs_in_progress(self):
+        older = SimilarityGeneration.objects.create()
+        retired = SimilarityGeneration.objects.create()
+        retired.activate()
+        in_progress = SimilarityGeneration.objects.create()
+        BookSimilarity.objects.create(
+            generation=in_progress, book1=Book.objects.first(), book2=Book.objects.last(), similarity=0.5
+        )
+
+        call_command('compute_similarities', stdout=StringIO())
+
+        remaining = SimilarityGeneration.objects.order_by('pk')
+        self.assertNotIn(older, remaining)
+        self.assertEqual(list(remaining.filter(is_active=False)), [retired, in_progress])
+        self.assertEqual(in_progress.similarities.count(), 1)
+
+    @skipUnless(find_spec('annoy'), 'annoy is not installed')
+    def test_approximate_run_below_the_recall_floor_is_not_published(self):
+        # A fresh checkout has no index directory yet
+        index_dir = os.path.join(self.index_dir, 'similarity')
+        with self.settings(SIMILARITY_INDEX_DIR=index_dir):
+            with mock.patch('library.management.commands.compute_similarities.recall_at_k', return_value=0.5):
+                with self.assertRaisesMessage(CommandError, 'below 0.8'):
+                    call_command('compute_similarities', backend='annoy', min_recall=0.8, stdout=StringIO())
+
+            self.assertFalse(SimilarityGeneration.objects.exists())
+            self.assertEqual(Book.objects.filter(similarity_dirty=False).count(), 0)
+            self.assertEqual(os.listdir(index_dir), [])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('compute_similarities', backend='annoy', min_recall=0.8, stdout=StringIO())
+            self.assertTrue(SimilarityGeneration.objects.filter(is_active=True).exists())
+            files = os.listdir(index_dir)
+            self.assertIn('books.annoy', files)
+            self.assertIn('books.annoy.ids.npy', files)
+            self.assertFalse([name for name in files if name.endswith('.new')])
+
+
+class SimilarityBackendTests(TestCase):
+    def clustered_matrix(self, clusters=8, per_cluster=25, n_features=64):
+        rng = np.random.default_rng(0)
+        centers = rng.random((clusters, n_features)) * (rng.random((clusters, n_features)) < 0.2)
+        rows = np.repeat(centers, per_cluster, axis=0)
+        rows += 0.3 * rng.random(rows.shape) * (rng.random(rows.shape) < 0.2)
+        return sparse.csr_matrix(normalize(rows))
+
+    def assert_recall(self, backend, minimum):
+        tfidf_matrix = self.clustered_matrix()
+        sample = set(sample_rows(tfidf_matrix.shape[0], 50).tolist())
+        approximate = {}
+        for start, results in get_backend(backend, k=10, block_size=64).iter_top_k(tfidf_matrix):
+            for offset, (indices, _) in enumerate(results):
+                if start + offset in sample:
+                    approximate[start + offset] = indices
+        self.assertEqual(len(approximate), 50)
+        self.assertGreaterEqual(recall_at_k(tfidf_matrix, approximate, k=10), minimum)
+
+    def test_exact_backend_has_full_recall(self):
+        self.assert_recall('exact', 1.0)
+
+    @skipUnless(find_spec('faiss'), 'faiss is not installed')
+    def test_faiss_backend_recall(self):
+        self.assert_recall('faiss', 0.9)
+
+    @skipUnless(find_spec('annoy'), 'annoy is not installed')
+    def test_annoy_backend_recall(self):
+        self.assert_recall('annoy', 0.9)
+
+    def test_recall_counts_missed_neighbours(self):
+        tfidf_matrix = self.clustered_matrix()
+        self.assertEqual(recall_at_k(tfidf_matrix, {0: []}, k=10), 0.0)
+
+    def test_sample_rows_is_sorted_distinct_and_bounded(self):
+        rows = sample_rows(100, 30)
+        self.assertEqual(list(rows), sorted(set(rows.tolist())))
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(list(sample_rows(100, 30)), list(rows))
+        self.assertEqual(list(sample_rows(5, 30)), [0, 1, 2, 3, 4])
+
+
+class ImportBooksTests(TemporaryIndexMixin, TestCase):
+    def write_records(self, records):
+        f = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8')
+        with f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_batched_import_shares_authors_and_shelves(self):
+        path = self.write_records([
+            {'title': 'A', 'isbn': '1', 'authors': [{'name': 'Jane Doe'}], 'shelves': [{'name': 'Fiction'}]},
+            {'title': 'B', 'isbn': '2', 'authors': [{'name': 'Jane Doe'}, {'name': 'Plato'}],
+             'shelves': [{'name': 'fiction'}, {'name': 'history'}]},
+            {'title': 'C', 'isbn': '3', 'authors': [{'name': 'Plato'}], 'num_pages': 'n/a'},
+        ])
+        call_command('import_books', path, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Book.objects.count(), 3)
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(sorted(Shelf.objects.values_list('name', flat=True)), ['fiction', 'history'])
+        book = Book.objects.get(title='B')
+        self.assertEqual(sorted(str(author) for author in book.authors.all()), ['Jane Doe', 'Plato '])
+        self.assertIsNone(Book.objects.get(title='C').num_pages)
+
+    def interrupted_import(self, path, **options):
+        """Run import_books with batches of 5 and a Ctrl-C after the second batch."""
+
+        load_safely = BookLoader.load_safely
+        batches = []
+
+        def interrupt(loader, records):
+            if len(batches) == 2:
+                raise KeyboardInterrupt
+            batches.append(records)
+            return load_safely(loader, records)
+
+        with mock.patch.object(BookLoader, 'load_safely', interrupt), self.assertRaises(KeyboardInterrupt):
+            call_command('import_books', path, batch_size=5, stdout=StringIO(), **options)
+
+    def test_interrupted_imports_resume_from_checkpoints(self):
+        def resume(path):
+            out = StringIO()
+            call_command('import_books', path, batch_size=5, checkpoint_dir=self.index_dir, stdout=out)
+            return out.getvalue()
+
+        jsonl = self.write_records([{'title': f'Book {i}', 'isbn': f'j{i}'} for i in range(23)])
+        self.interrupted_import(jsonl, checkpoint_dir=self.index_dir)
+        self.assertEqual(Book.objects.count(), 10)
+        self.assertIn('Successfully loaded 13 records (13 inserted', resume(jsonl))
+        self.assertEqual(Book.objects.count(), 23)
+
+        # Another file in the same directory starts from its own checkpoint, not the first file's
+        other = self.write_records([{'title': f'Other {i}', 'isbn': f'o{i}'} for i in range(23)])
+        self.assertIn('Successfully loaded 23 records', resume(other))
+
+        array = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8')
+        with array:
+            json.dump([{'title': f'Array {i}', 'isbn': f'a{i}'} for i in range(23)], array)
+        self.addCleanup(os.remove, array.name)
+        self.interrupted_import(array.name, checkpoint_dir=self.index_dir)
+        self.assertEqual(Book.objects.filter(isbn__startswith='a').count(), 10)
+        self.assertIn('Successfully loaded 13 records', resume(array.name))
+        self.assertEqual(Book.objects.filter(isbn__startswith='a').count(), 23)
+        self.assertEqual(Book.objects.count(), 69)
+
+    def test_failed_import_raises_command_error_and_records_it(self):
+        metrics_file = os.path.join(self.index_dir, 'metrics.json')
+        missing = os.path.join(self.index_dir, 'missing.jsonl')
+        with self.assertRaisesMessage(CommandError, 'Import failed'):
+            call_command('import_books', missing, metrics_file=metrics_file, stdout=StringIO())
+
+        with open(metrics_file, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['status'], 'failed')
+
+    def test_resume_with_another_shard_layout_is_rejected(self):
+        path = self.write_records([{'title': f'Book {i}', 'isbn': str(i)} for i in range(50)])
+        ImportCheckpoints(self.index_dir, path).ranges(shard_ranges(path, 4))
+        ImportCheckpoints(self.index_dir, path).ranges(shard_ranges(path, 4))
+        with self.assertRaisesMessage(ValueError, 'split into 4 ranges, not 8'):
+            ImportCheckpoints(self.index_dir, path).ranges(shard_ranges(path, 8))
+
+    def test_shards_cover_every_line_once(self):
+        path = self.write_records([{'title': f'Book {i}', 'isbn': str(i)} for i in range(50)])
+        lines = [
+            line
+            for start, end in shard_ranges(path, 7)
+            for line, _ in iter_jsonl_range(path, start, end)
+        ]
+        with open(path, 'rb') as f:
+            self.assertEqual(lines, f.readlines())
+
+    def test_upsert_updates_changed_books_and_skips_unchanged(self):
+        records = [
+            {'title': 'A', 'isbn': '1', 'isbn13': '9780000000001', 'authors': [{'name': 'Jane Doe'}]},
+            {'title': 'B', 'isbn': '2', 'authors': [{'name': 'Plato'}]},
+        ]
+        call_command('import_books', self.write_records(records), upsert=True, stdout=StringIO())
+        records[0]['title'] = 'A, revised'
+        out = StringIO()
+        call_command('import_books', self.write_records(records), upsert=True, stdout=out)
+
+        self.assertIn('(0 inserted, 1 updated, 1 unchanged)', out.getvalue())
+        self.assertEqual(Book.objects.count(), 2)
+        book = Book.objects.get(isbn13='9780000000001')
+        self.assertEqual(book.title, 'A, revised')
+        self.assertEqual([str(author) for author in book.authors.all()], ['Jane Doe'])
+
+    def test_metrics_file_records_phases(self):
+        path = self.write_records([{'title': f'Book {i}', 'isbn': str(i)} for i in range(5)])
+        metrics_path = f'{path}.metrics.json'
+        self.addCleanup(os.remove, metrics_path)
+        out = StringIO()
+        call_command('import_books', path, batch_size=2, limit=5, metrics_file=metrics_path, stdout=out)
+
+        self.assertIn('rows/s', out.getvalue())
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+        self.assertEqual(metrics['status'], 'ok')
+        self.assertEqual([phase['name'] for phase in metrics['phases']], ['load', 'suggest_index'])
+        self.assertEqual(metrics['phases'][0]['rows'], 5)
+        self.assertEqual(metrics['counters'], {'inserted': 5})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Pool workers need a database server they can connect to')
+class ParallelImportTests(TemporaryIndexMixin, TransactionTestCase):
+    def test_resumes_jsonl_ranges_and_json_arrays(self):
+        jsonl = os.path.join(self.index_dir, 'books.jsonl')
+        with open(jsonl, 'w', encoding='utf-8') as f:
+            for i in range(40):
+                record = {'title': f'Book {i}', 'isbn': f'j{i}', 'authors': [{'name': f'Author {i % 3}'}]}
+                f.write(json.dumps(record) + '\n')
+        stats, errors = ParallelImport(jsonl, 2, batch_size=5, checkpoint_dir=self.index_dir).run()
+        self.assertEqual((stats['inserted'], errors), (40, []))
+        stats, _ = ParallelImport(jsonl, 2, batch_size=5, checkpoint_dir=self.index_dir).run()
+        self.assertEqual(sum(stats.values()), 0)
+        with self.assertRaises(ValueError):
+            ParallelImport(jsonl, 3, batch_size=5, checkpoint_dir=self.index_dir).run()
+
+        array = os.path.join(self.index_dir, 'books.json')
+        with open(array, 'w', encoding='utf-8') as f:
+            json.dump([{'title': f'Array {i}', 'isbn': f'a{i}'} for i in range(30)], f)
+        # A single-process run stopped after 10 records; the pool picks up from its checkpoint
+        load_array(BookLoader(), array, 5, ImportCheckpoints(self.index_dir, array).array(), limit=10)
+        stats, _ = ParallelImport(array, 2, batch_size=5, checkpoint_dir=self.index_dir).run()
+        self.assertEqual(stats['inserted'], 20)
+        self.assertEqual(Book.objects.count(), 70)
+        self.assertEqual(Book.objects.filter(authors__isnull=False).distinct().count(), 40)
+
+
+@override_settings(SIMILARITY_INDEX_DIR=NO_INDEX_DIR, SUGGEST_INDEX_PATH=os.path.join(NO_INDEX_DIR, 'suggest.idx'))
+class ClearDatabaseTests(TestCase):
+    def test_noinput_clears_books_and_their_dependants(self):
+        user = User.objects.create_user(username='reader', password='password123')
+        books = [Book.objects.create(title=f'Book {i}', isbn=str(i)) for i in range(3)]
+        books[0].authors.add(Author.objects.create(first_name='Jane', last_name='Doe'))
+        books[0].shelves.add(Shelf.objects.create(name='fiction'))
+        Favorite.objects.create(user=user, book=books[1])
+        generation = SimilarityGeneration.objects.create(is_active=True)
+        BookSimilarity.objects.create(generation=generation, book1=books[0], book2=books[2], similarity=0.5)
+
+        call_command('clear_database', interactive=False, stdout=StringIO())
+
+        self.assertFalse(Book.objects.exists())
+        self.assertFalse(Author.objects.exists())
+        self.assertFalse(Favorite.objects.exists())
+        self.assertFalse(BookSimilarity.objects.exists())
+        self.assertFalse(Book.shelves.through.objects.exists())
+        self.assertTrue(Shelf.objects.exists())
+        self.assertTrue(User.objects.exists())
+
+    def test_noinput_failure_exits_non_zero_and_is_recorded(self):
+        Book.objects.create(title='Kept', isbn='1')
+        metrics_file = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        metrics_file.close()
+        self.addCleanup(os.remove, metrics_file.name)
+        stderr = StringIO()
+
+        with mock.patch(
+            'library.management.commands.clear_database.clear_tables', side_effect=RuntimeError('table is locked')
+        ):
+            # execute_from_command_line takes no stdout argument; capture it like call_command(stdout=StringIO())
+            with redirect_stdout(StringIO()), redirect_stderr(stderr), self.assertRaises(SystemExit) as raised:
+                execute_from_command_line(
+                    ['manage.py', 'clear_database', '--noinput', '--metrics-file', metrics_file.name]
+                )
+
+        self.assertEqual(raised.exception.code, 1)
+        self.assertIn('table is locked', stderr.getvalue())
+        with open(metrics_file.name, encoding='utf-8') as f:
+            metrics = json.load(f)
+        self.assertEqual(metrics['status'], 'failed')
+        self.assertIn('table is locked', metrics['error'])
+        self.assertTrue(Book.objects.exists())
+
+
+@override_settings(SIMILARITY_INDEX_DIR=NO_INDEX_DIR, METRICS_TOKEN='scrape')
+class RecommendationCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.client.force_authenticate(user=self.user)
+        self.book1 = Book.objects.create(title='Django for Beginners', isbn='1234567890123')
+        self.book2 = Book.objects.create(title='Advanced Django', isbn='1234567890124')
+        generation = SimilarityGeneration.objects.create()
+        generation.activate()
+        BookSimilarity.objects.create(generation=generation, book1=self.book1, book2=self.book2, similarity=0.5)
+
+    def test_cache_hit_costs_no_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/library/favorites/', {'book_id': self.book1.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        hits = registry.count(CACHE_COUNTER, result='hit')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/library/recommendations/')
+        self.assertEqual([book['id'] for book in response.data], [self.book2.id])
+        self.assertEqual(registry.count(CACHE_COUNTER, result='hit'), hits + 1)
+        metrics = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn(f'{CACHE_COUNTER}{{result="hit"}} {hits + 1}', metrics.splitlines())
+
+    def test_favorite_removal_and_rebuild_refresh_cache(self):
+        self.client.post('/api/library/favorites/', {'book_id': self.book1.id})
+        self.client.delete(f'/api/library/favorites/{self.book1.id}/')
+        self.assertEqual(self.client.get('/api/library/recommendations/').data, [])
+
+        Favorite.objects.create(user=self.user, book=self.book1)
+        invalidate_all_recommendations()
+        response = self.client.get('/api/library/recommendations/')
+        self.assertEqual([book['id'] for book in response.data], [self.book2.id])
+
+    def test_favorite_add_does_not_wait_for_refresh(self):
+        with mock.patch('library.views.refresh_user_recommendations.delay') as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post('/api/library/favorites/', {'book_id': self.book1.id})
+            # Not before the favorite is committed, or a worker could re-cache the old favorites
+            delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        delay.assert_called_once_with(self.user.pk)
+        self.assertNotIn('recommendations', response.data)
+
+
+@override_settings(SIMILARITY_INDEX_DIR=NO_INDEX_DIR)
+class QueryBudgetTests(TestCase):
+    """Read endpoints must run a fixed number of queries whatever the page size."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        generation = SimilarityGeneration.objects.create()
+        generation.activate()
+        shelves = [Shelf.objects.create(name=f'shelf {i}') for i in range(3)]
+        self.books = []
+        for i in range(30):
+            book = Book.objects.create(title=f'Book {i}', isbn=str(1000 + i))
+            book.authors.add(Author.objects.create(first_name=f'First{i}', last_name='Last'))
+            book.shelves.set(shelves[:i % 3 + 1])
+            self.books.append(book)
+        for book in self.books[1:]:
+            BookSimilarity.objects.create(generation=generation, book1=self.books[0], book2=book, similarity=0.5)
+        for book in self.books[:20]:
+            Favorite.objects.create(user=self.user, book=book)
+
+    def test_book_list(self):
+        # COUNT, page, authors, shelves
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/library/books/')
+        self.assertEqual(len(response.json()['results']), 30)
+
+    def test_book_search(self):
+        with self.assertNumQueries(4):
+            self.client.get('/api/library/books/', {'search': 'First1'})
+
+    def test_book_retrieve(self):
+        with self.assertNumQueries(3):
+            self.client.get(f'/api/library/books/{self.books[0].id}/')
+
+    def test_favorite_list(self):
+        self.client.force_authenticate(user=self.user)
+        # Favorites joined to books, authors, shelves
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/library/favorites/')
+        self.assertEqual(len(response.data), 20)
+
+    def test_recommendations_cache_miss(self):
+        self.client.force_authenticate(user=self.user)
+        # Favorites, similarity aggregate, books, authors, shelves
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/library/recommendations/')
+        self.assertEqual(len(response.data), 5)
+
+    def test_book_list_cursor_pages_cost_the_same(self):
+        # Page, authors, shelves; no COUNT and no OFFSET
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/library/books/', {'pagination': 'cursor', 'page_size': 7})
+        seen = [book['id'] for book in response.json()['results']]
+        while response.json()['next']:
+            with self.assertNumQueries(3):
+                response = self.client.get(response.json()['next'])
+            seen.extend(book['id'] for book in response.json()['results'])
+        self.assertEqual(seen, sorted(book.id for book in self.books))
+        self.assertIsNone(response.json()['next'])
+
+    def test_read_representation_renders_like_book_serializer(self):
+        book_ids = [book.id for book in reversed(self.books)]
+        expected = JSONRenderer().render(BookSerializer(
+            [Book.objects.prefetch_related('authors', 'shelves').get(id=book_id) for book_id in book_ids], many=True
+        ).data)
+        data = represent_books(book_ids)
+        self.assertEqual(JSONRenderer().render(data), expected)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+
+    def test_sparse_fieldsets_skip_unrequested_columns_and_relations(self):
+        # COUNT, page; no description column and no authors or shelves queries
+        with self.assertNumQueries(2) as queries:
+            response = self.client.get('/api/library/books/', {'fields': 'id,title'})
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'title'])
+        self.assertNotIn('description', queries.captured_queries[1]['sql'])
+
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/library/favorites/', {'exclude': 'description,shelves'})
+        self.assertEqual(list(response.data[0]), ['id', 'title', 'publication_date', 'isbn', 'authors'])
+        response = self.client.get('/api/library/recommendations/', {'fields': 'title'})
+        self.assertEqual([list(book) for book in response.data], [['title']] * 5)
+        self.assertEqual(self.client.get('/api/library/books/', {'fields': 'title,price'}).status_code, 400)
+
+    def test_author_list_page_number_mode_unchanged(self):
+        response = self.client.get('/api/library/authors/', {'page': 2, 'page_size': 10})
+        self.assertEqual(response.json()['count'], 30)
+        self.assertEqual(len(response.json()['results']), 10)
+
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        tolkien = Author.objects.create(first_name='John', last_name='Tolkien')
+        christopher = Author.objects.create(first_name='Christopher', last_name='Tolkien')
+        self.hobbit = Book.objects.create(title='The Hobbit', isbn='1', description='A dragon and a burglar.')
+        self.hobbit.authors.set([tolkien, christopher])
+        self.dragons = Book.objects.create(title='Dragons', isbn='2', description='Not about hobbits.')
+        self.dragons.authors.add(Author.objects.create(first_name='Ann', last_name='Other'))
+        self.poems = Book.objects.create(title='Poems', isbn='3')
+        self.poems.shelves.add(Shelf.objects.create(name='fantasy-classics'))
+
+    def search(self, text):
+        response = self.client.get('/api/library/books/', {'search': text})
+        return [book['id'] for book in response.json()['results']]
+
+    def test_book_matching_several_authors_is_returned_once(self):
+        self.assertEqual(self.search('tolkien'), [self.hobbit.id])
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('hobbit'), [self.hobbit.id, self.dragons.id])
+
+    def test_searches_shelves_and_description(self):
+        self.assertEqual(self.search('fantasy'), [self.poems.id])
+        self.assertEqual(self.search('burglar'), [self.hobbit.id])
+
+
+class SuggestTests(TemporaryIndexMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.hobbit = Book.objects.create(title='The Hobbit', isbn='1')
+        self.hobbit.authors.add(Author.objects.create(first_name='Émile', last_name='Zola'))
+        Book.objects.create(title='Harry Potter and the Chamber of Secrets', isbn='2')
+        Book.objects.create(title='Hard Times', isbn='3')
+        call_command('build_suggest_index', stdout=StringIO())
+
+    def suggest(self, q):
+        return [(item['type'], item['text']) for item in self.client.get('/api/library/books/suggest/', {'q': q}).data]
+
+    def test_prefix_completions(self):
+        self.assertEqual(self.suggest('har'), [('title', 'Hard Times'), ('title', 'Harry Potter and the Chamber of Secrets')])
+        self.assertEqual(self.suggest('emi'), [('author', 'Émile Zola')])
+        self.assertEqual(self.suggest('harry cham'), [('title', 'Harry Potter and the Chamber of Secrets')])
+        self.assertEqual(self.suggest('xyz'), [])
+
+    def test_api_writes_update_index(self):
+        main = os.stat(settings.SUGGEST_INDEX_PATH)
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/api/library/books/{self.hobbit.id}/', {
+                'title': 'The Silmarillion', 'isbn': '1', 'authors': [{'first_name': 'John', 'last_name': 'Tolkien'}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.suggest('hob'), [])
+        self.assertEqual(self.suggest('silm'), [('title', 'The Silmarillion')])
+        self.assertEqual(self.suggest('tolk'), [('author', 'John Tolkien')])
+        # Edits only rewrite the delta segment; a rebuild folds it into the main one
+        self.assertEqual(os.stat(settings.SUGGEST_INDEX_PATH).st_mtime_ns, main.st_mtime_ns)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/library/books/{Book.objects.get(isbn="3").id}/')
+        self.assertEqual(self.suggest('har'), [('title', 'Harry Potter and the Chamber of Secrets')])
+
+        build_index()
+        self.assertFalse(os.path.exists(delta_path(settings.SUGGEST_INDEX_PATH)))
+        self.assertEqual(self.suggest('silm'), [('title', 'The Silmarillion')])
+        self.assertEqual(self.suggest('har'), [('title', 'Harry Potter and the Chamber of Secrets')])
+
+
+@override_settings(CATALOG_RESPONSE_CACHE=True)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='password123')
+        self.author = Author.objects.create(first_name='Jane', last_name='Doe')
+        self.book = Book.objects.create(title='Cached', isbn='1')
+        self.book.authors.add(self.author)
+        self.url = f'/api/library/books/{self.book.id}/'
+
+    def test_repeat_read_is_served_from_cache_and_revalidates(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+
+    def test_off_without_a_shared_cache(self):
+        with self.settings(CATALOG_RESPONSE_CACHE=False):
+            self.client.get(self.url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries.captured_queries)
+        self.assertNotIn('ETag', response)
+
+    def test_writes_invalidate_books_and_lists(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.get('/api/library/books/')
+        self.client.force_authenticate(user=self.user)
+        self.client.patch(f'/api/library/authors/{self.author.id}/', {'first_name': 'Janet', 'last_name': 'Doe'})
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Janet', response.content)
+        self.assertIn(b'Janet', self.client.get('/api/library/books/').content)
+
+        Book.objects.create(title='Another', isbn='2')
+        self.assertEqual(self.client.get('/api/library/books/').json()['count'], 2)
+
+
+class SimilarBooksTests(TemporaryIndexMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        author = Author.objects.create(first_name='Jane', last_name='Doe')
+        shelves = [Shelf.objects.create(name=name) for name in ('fantasy', 'dragons', 'poetry')]
+        self.books = []
+        for i, shelf_names in enumerate([(0, 1), (0, 1), (0,), (2,)]):
+            book = Book.objects.create(title=f'Book {i}', isbn=str(i))
+            book.authors.add(author)
+            book.shelves.set([shelves[j] for j in shelf_names])
+            self.books.append(book)
+        call_command('compute_similarities', stdout=StringIO())
+
+    def test_served_from_neighbour_table(self):
+        url = f'/api/library/books/{self.books[0].id}/similar/'
+        # Books, authors, shelves; the neighbour list itself comes from the snapshot
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        stored = list(BookSimilarity.objects.active().filter(book1=self.books[0]).order_by('-similarity').values_list(
+            'book2_id', flat=True
+        ))
+        self.assertEqual([book['id'] for book in response.data], stored)
+        self.assertEqual(response.data[0]['id'], self.books[1].id)
+        self.assertEqual(len(self.client.get(url, {'limit': 1}).data), 1)
+        self.assertEqual(self.client.get('/api/library/books/999999/similar/').status_code, 404)
+
+    def test_recommender_matches_sql(self):
+        def rounded(ranking):
+            return [(book_id, round(score, 5)) for book_id, score in ranking]
+
+        favorites = [self.books[0].id, self.books[3].id]
+        self.assertEqual(rounded(rank_recommendations(favorites)), rounded(_sql_recommendations(favorites, 5)))
+        user = User.objects.create_user(username='reader', password='password123')
+        for book_id in favorites:
+            Favorite.objects.create(user=user, book_id=book_id)
+        other = User.objects.create_user(username='nobody', password='password123')
+        batch = recommend_for_users([user.id, other.id])
+        self.assertEqual(rounded(batch[user.id]), rounded(rank_recommendations(favorites)))
+        self.assertEqual(batch[other.id], [])
+
+
+@override_settings(REQUEST_PROFILING_TOKEN='secret', METRICS_TOKEN='scrape')
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        for i in range(3):
+            Book.objects.create(title=f'Profiled {i}', isbn=str(i))
+
+    def test_only_requests_with_the_token_are_profiled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/library/books/'))
+        self.assertNotIn('Server-Timing', self.client.get('/api/library/books/', HTTP_X_REQUEST_PROFILE='wrong'))
+
+        response = self.client.get('/api/library/books/?page_size=2', HTTP_X_REQUEST_PROFILE='secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('BookSerializer;dur=', response['Server-Timing'])
+
+        metrics = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('library_request_duration_seconds_count{view="BookViewSet.list"}', metrics)
+        self.assertIn('library_serializer_seconds_total{view="BookViewSet.list",serializer="BookSerializer"}', metrics)
+        # Requests relayed by a local reverse proxy all come from 127.0.0.1
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+
+class SyntheticCatalogTests(TestCase):
+    def test_records_are_seeded_and_share_prefixes(self):
+        small = list(CatalogGenerator(seed=3).records(20))
+        large = list(CatalogGenerator(seed=3).records(50))
+        self.assertEqual(small, large[:20])
+        self.assertEqual(list(CatalogGenerator(seed=3).records(10, start=20)), large[20:30])
+        self.assertNotEqual(small, list(CatalogGenerator(seed=4).records(20)))
+        self.assertEqual(len({record['isbn13'] for record in large}), 50)
@@ -1,55 +1,56 @@
-from rest_framework import generics, viewsets, filters, status
+import hmac
+
+from rest_framework import generics, viewsets, status
+from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.db.models import OuterRef, Subquery
 from django.shortcuts import get_object_or_404
-from django.db.models import Sum
+from .caching import AUTHOR_DATA_KEY, AUTHORS_KEY, BOOKS_KEY, CachedReadMixin, author_key, book_key
 from .pagination import StandardResultsSetPagination
-from .models import Book, Author, Favorite, BookSimilarity, Shelf
+from .models import Book, Author, BookSimilarity, Favorite, Shelf
+from .neighbours import get_table
+from .profiling import registry as profiling_registry
+from .search import BookSearchFilter, update_search_vectors
+from .recommendations import cached_recommendations, get_recommendations, invalidate_recommendations
+from .suggest import DEFAULT_LIMIT as SUGGEST_LIMIT, MAX_LIMIT as SUGGEST_MAX_LIMIT, get_index
+from .tasks import refresh_user_recommendations, schedule_suggest_index_update
 from .serializers import (
     RegisterSerializer,
     CustomTokenObtainPairSerializer,
+    BOOK_FIELDS,
+    BookReadSerializer,
     BookSerializer,
     AuthorSerializer,
     FavoriteSerializer,
+    book_columns,
+    book_fields,
+    book_representations,
+    represent_books,
 )
 
 User = get_user_model()
 
-def get_recommendations(user):
-    favorite_books = Favorite.objects.filter(user=user).values_list('book', flat=True)
-    favorite_books = list(favorite_books)
-
-    if not favorite_books:
-        return []
-
-    # Get similar books
-    similar_books = BookSimilarity.objects.filter(
-        book1_id__in=favorite_books
-    ).exclude(
-        book2_id__in=favorite_books
-    ).values(
-        'book2_id'
-    ).annotate(
-        total_similarity=Sum('similarity')
-    ).order_by('-total_similarity')[:5]
-
-    # Retrieve book instances
-    recommended_books_ids = [item['book2_id'] for item in similar_books]
-    recommended_books = Book.objects.filter(id__in=recommended_books_ids)
-
-    serializer = BookSerializer(recommended_books, many=True)
-    return serializer.data
+# Neighbours returned by /books/{id}/similar/ unless ?limit= asks for more
+SIMILAR_LIMIT = 10
 
 class RecommendationView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
+        fields = book_fields(request.query_params)
         recommendations = get_recommendations(user)
+        if fields != BOOK_FIELDS:
+            # Cached whole for every caller, so trimmed here rather than in the query
+            recommendations = [{field: book[field] for field in fields} for book in recommendations]
         return Response(recommendations, status=status.HTTP_200_OK)
 
 class RegisterView(generics.CreateAPIView):
@@ -61,24 +62,130 @@ class LoginView(TokenObtainPairView):
     permission_classes = [AllowAny]
     serializer_class = CustomTokenObtainPairSerializer
 
-class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+class BookViewSet(CachedReadMixin, viewsets.ModelViewSet):
+    queryset = Book.objects.defer('search_vector', 'tfidf_vector').order_by('id')
     serializer_class = BookSerializer
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['title', 'authors__first_name', 'authors__last_name']
+    filter_backends = [BookSearchFilter]
     pagination_class = StandardResultsSetPagination
+    cache_list_versions = (BOOKS_KEY,)
+    cache_detail_versions = (book_key('{pk}'), AUTHOR_DATA_KEY)
+
+    # Actions served from ``.values()`` rows by BookReadSerializer, limited to ``?fields=`` / ``?exclude=``
+    read_actions = ('list', 'retrieve')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.read_actions:
+            return queryset
+        return queryset.prefetch_related('authors', 'shelves')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.read_actions:
+            # Newest author edit, for Last-Modified; evaluated only for the rows returned
+            authors_updated_at = Subquery(
+                Author.objects.filter(book=OuterRef('pk')).order_by('-updated_at').values('updated_at')[:1]
+            )
+            queryset = queryset.values(
+                *book_columns(book_fields(self.request.query_params)), 'updated_at', authors_updated_at=authors_updated_at
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in self.read_actions:
+            return BookReadSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.read_actions:
+            context['fields'] = book_fields(self.request.query_params)
+        return context
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'suggest', 'similar']:
             permission_classes = []  # Allow any
         else:
             permission_classes = [IsAuthenticated]
         return [permission() for permission in permission_classes]
 
-class AuthorViewSet(viewsets.ModelViewSet):
-    queryset = Author.objects.all()
+    @action(detail=False)
+    def suggest(self, request):
+        """Title and author completions for ``?q=``, served from the memory-mapped suggest index."""
+        try:
+            limit = min(int(request.query_params.get('limit', SUGGEST_LIMIT)), SUGGEST_MAX_LIMIT)
+        except ValueError:
+            limit = SUGGEST_LIMIT
+        index = get_index()
+        if index is None or limit < 1:
+            return Response([])
+        return Response(index.suggest(request.query_params.get('q', ''), limit))
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        """The book's nearest neighbours, best first, each with its ``similarity``."""
+        try:
+            book_id = int(pk)
+            limit = max(1, int(request.query_params.get('limit', SIMILAR_LIMIT)))
+        except ValueError:
+            raise Http404
+        table = get_table()
+        found = table.neighbours(book_id, limit) if table is not None else None
+        if found is None:
+            # No table yet, or the book is newer than the last rebuild
+            get_object_or_404(Book, pk=book_id)
+            rows = list(BookSimilarity.objects.active().filter(book1_id=book_id).order_by(
+                '-similarity', 'book2_id'
+            ).values_list('book2_id', 'similarity')[:limit])
+            neighbour_ids = [neighbour_id for neighbour_id, _ in rows]
+            scores = [score for _, score in rows]
+        else:
+            neighbour_ids, scores = found[0].tolist(), found[1].tolist()
+
+        fields = book_fields(request.query_params)
+        books = {book['id']: book for book in represent_books(neighbour_ids, ('id', *fields))}
+        results = []
+        for neighbour_id, score in zip(neighbour_ids, scores):
+            if neighbour_id in books:
+                results.append({**{field: books[neighbour_id][field] for field in fields}, 'similarity': score})
+        return Response(results)
+
+    def object_last_modified(self, book):
+        return max(book['updated_at'], book['authors_updated_at'] or book['updated_at'])
+
+    def perform_create(self, serializer):
+        book = serializer.save()
+        schedule_suggest_index_update([book.id], book.authors.values_list('id', flat=True))
+
+    def perform_update(self, serializer):
+        book = serializer.save()
+        schedule_suggest_index_update([book.id], book.authors.values_list('id', flat=True))
+
+    def perform_destroy(self, instance):
+        book_id = instance.id
+        instance.delete()
+        schedule_suggest_index_update([book_id])
+
+class AuthorViewSet(CachedReadMixin, viewsets.ModelViewSet):
+    queryset = Author.objects.order_by('id')
     serializer_class = AuthorSerializer
     pagination_class = StandardResultsSetPagination
+    cache_list_versions = (AUTHORS_KEY,)
+    cache_detail_versions = (author_key('{pk}'),)
+
+    def perform_create(self, serializer):
+        author = serializer.save()
+        schedule_suggest_index_update(author_ids=[author.id])
+
+    def perform_update(self, serializer):
+        author = serializer.save()
+        update_search_vectors(author.book_set.values_list('id', flat=True))
+        schedule_suggest_index_update(author_ids=[author.id])
+
+    def perform_destroy(self, instance):
+        author_id = instance.id
+        instance.delete()
+        schedule_suggest_index_update(author_ids=[author_id])
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -95,22 +202,43 @@ class FavoriteViewSet(viewsets.ViewSet):
         return Favorite.objects.filter(user=self.request.user)
 
     def list(self, request):
-        favorites = self.get_queryset()
-        books = [favorite.book for favorite in favorites]
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data)
+        fields = book_fields(request.query_params)
+        books = Book.objects.filter(favorite__user=request.user).order_by('-favorite__added_on')
+        return Response(book_representations(books.values(*book_columns(fields)), fields))
 
     def create(self, request):
         serializer = FavoriteSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         favorite = serializer.save()
-        recommendations = get_recommendations(request.user)
-        return Response({
-            'detail': 'Book added to favorites.',
-            'recommendations': recommendations
-        }, status=status.HTTP_201_CREATED)
+        self.schedule_recommendation_refresh(request.user.pk)
+        data = {'detail': 'Book added to favorites.'}
+        if settings.FAVORITE_RESPONSE_INCLUDES_RECOMMENDATIONS:
+            # Present when the refresh already ran (eager mode) or another request refreshed them
+            recommendations = cached_recommendations(request.user.pk)
+            if recommendations is not None:
+                data['recommendations'] = recommendations
+        return Response(data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, book_id=None):
         favorite = get_object_or_404(Favorite, user=request.user, book_id=book_id)
         favorite.delete()
+        self.schedule_recommendation_refresh(request.user.pk)
         return Response({'detail': 'Book removed from favorites.'}, status=status.HTTP_204_NO_CONTENT)
+
+    def schedule_recommendation_refresh(self, user_id):
+        # Drop the stale entry now, but refresh only once the favorite change is committed and visible to the task
+        invalidate_recommendations(user_id)
+        transaction.on_commit(lambda: refresh_user_recommendations.delay(user_id))
+
+
+def metrics(request):
+    """
+    Prometheus scrape target for the request profiling aggregates, for
+    requests bearing METRICS_TOKEN. Behind a reverse proxy every request
+    comes from the proxy's address, so the client address proves nothing.
+    Reports only this process; see ``profiling.MetricsRegistry``.
+    """
+    token = settings.METRICS_TOKEN
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        raise Http404
+    return HttpResponse(profiling_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django_extensions',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'library',
     'rest_framework',
     'rest_framework_simplejwt',
@@ -65,6 +66,7 @@ AUTH_PASSWORD_VALIDATORS = [
     # ... default validators ...
 ]
 MIDDLEWARE = [
+    'library.profiling.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -160,3 +162,78 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Directory where compute_similarities saves approximate nearest-neighbour indexes
+SIMILARITY_INDEX_DIR = config('SIMILARITY_INDEX_DIR', default=str(BASE_DIR / 'data' / 'similarity'))
+
+# Sampled recall@K an approximate compute_similarities run must reach before its generation is published
+SIMILARITY_MIN_RECALL = config('SIMILARITY_MIN_RECALL', default=0.9, cast=float)
+
+# Cache: Redis when REDIS_URL is set, otherwise a per-process local memory cache
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'library',
+        }
+    }
+
+# Seconds a user's cached recommendations are kept
+RECOMMENDATION_CACHE_TIMEOUT = config('RECOMMENDATION_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+
+# Celery: without a broker, tasks run eagerly in-process (tests, single-node deployments)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default=REDIS_URL)
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=not CELERY_BROKER_URL, cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_IGNORE_RESULT = True
+
+# Include already-fresh cached recommendations in the POST /favorites/ response
+FAVORITE_RESPONSE_INCLUDES_RECOMMENDATIONS = config(
+    'FAVORITE_RESPONSE_INCLUDES_RECOMMENDATIONS', default=True, cast=bool
+)
+
+# Book search backend: 'postgres' (tsvector + pg_trgm), 'simple' (portable, for local testing) or 'auto'
+BOOK_SEARCH_BACKEND = config('BOOK_SEARCH_BACKEND', default='auto')
+
+# Memory-mapped title/author completion index served by /books/suggest/
+SUGGEST_INDEX_PATH = config('SUGGEST_INDEX_PATH', default=str(BASE_DIR / 'data' / 'suggest.idx'))
+# Edits go to a small delta segment merged at query time; past this many changed rows a Celery worker rebuilds
+# the index. Tasks running eagerly never rebuild inside a request: run build_suggest_index periodically instead.
+SUGGEST_DELTA_MAX_ENTRIES = config('SUGGEST_DELTA_MAX_ENTRIES', default=10000, cast=int)
+
+# Seconds rendered book/author list and detail responses are cached; writes invalidate them sooner
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=60 * 60, cast=int)
+# The response cache needs a cache shared by every process: writes from other workers and management
+# commands invalidate entries by bumping counters there. Off with the per-process local memory cache.
+CATALOG_RESPONSE_CACHE = config('CATALOG_RESPONSE_CACHE', default=bool(REDIS_URL), cast=bool)
+
+# Per-request profiling (library.profiling): every request, or only those sending the token in X-Request-Profile
+REQUEST_PROFILING = config('REQUEST_PROFILING', default=False, cast=bool)
+REQUEST_PROFILING_TOKEN = config('REQUEST_PROFILING_TOKEN', default='')
+# A statement repeated this many times in one request is logged as a likely N+1
+REQUEST_PROFILING_DUPLICATE_THRESHOLD = config('REQUEST_PROFILING_DUPLICATE_THRESHOLD', default=5, cast=int)
+# Profiled requests slower than this leave a 'cprofile' or 'pyinstrument' trace in the directory, when set
+REQUEST_PROFILING_SLOW_MS = config('REQUEST_PROFILING_SLOW_MS', default=500, cast=int)
+REQUEST_PROFILING_TRACE_DIR = config('REQUEST_PROFILING_TRACE_DIR', default='')
+REQUEST_PROFILING_TRACER = config('REQUEST_PROFILING_TRACER', default='cprofile')
+
+# Bearer token Prometheus sends to scrape /metrics/ ('Authorization: Bearer <token>'); the endpoint is off when empty.
+# Metrics live in the memory of the process answering the scrape: only accurate with a single worker process.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Render API responses with orjson (library.renderers.FastJSONRenderer) when it is installed; same output
+FAST_JSON_RENDERER = config('FAST_JSON_RENDERER', default=False, cast=bool)
+if FAST_JSON_RENDERER:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = (
+        'library.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    )
@@ -18,6 +18,7 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path, include
+from library.views import metrics
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -28,6 +29,7 @@ urlpatterns = [
     path('api/library/', include('library.urls')),  # Include your app's URLs
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),        # For obtaining tokens
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),       # For refreshing tokens
+    path('metrics/', metrics, name='metrics'),
 ]
 
 